@@ -5,6 +5,7 @@ import time
 from dotenv import load_dotenv
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+import zone_index
 
 # Configuration (from .env)
 DOMAINS_FILE = "domains.txt"
@@ -49,6 +50,7 @@ def add_domain(domain):
             result = response.json()
             print(f"Added domain {domain}: {result}")
             save_completed_domain(domain)  # Mark as completed
+            zone_index.invalidate_zones()  # The cached zone index no longer lists every zone
             return result.get("result", {}).get("id")
         except requests.exceptions.RequestException as e:
             print(f"Error adding domain {domain}: {e}")
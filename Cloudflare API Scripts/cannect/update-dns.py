@@ -2,18 +2,82 @@ import requests
 import json
 import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import zone_index
 
 # Configuration (from .env)
 DOMAINS_FILE = "domains.txt"
+WORKERS = 8  # Domains updated concurrently
+RATE_LIMIT_PER_SEC = 1200 / 300  # Cloudflare allows 1200 requests per 5 minutes per user
+RATE_LIMIT_BURST = 10  # Requests allowed back to back before the rate applies
+RATE_LIMIT_DELAY = 60  # Time to wait on 429 Too Many Requests without a Retry-After header
+MAX_RETRIES = 5  # 429 retries per request before giving up
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every worker, so all requests together stay under the rate."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0  # Monotonic deadline set by pause()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Holds back every worker for the given seconds, e.g. after a 429.
+        Overlapping pauses share one deadline instead of adding up.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # Refill from the deadline, so workers don't burst as soon as it passes
+            self.tokens = 0
+            self.updated = self.paused_until
+
+rate_limiter = TokenBucket(RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+
+def api_request(method, url, headers, **kwargs):
+    """Sends a rate-limited request, waiting out 429 responses as Retry-After asks."""
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        response = requests.request(method, url, headers=headers, **kwargs)
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            break
+        try:
+            delay = float(response.headers.get("Retry-After", RATE_LIMIT_DELAY))
+        except ValueError:
+            delay = RATE_LIMIT_DELAY
+        print(f"Rate limit hit. Waiting {delay:.0f} seconds...")
+        rate_limiter.pause(delay)
+    response.raise_for_status()
+    return response
 
 def update_dns_records(domain, ip_address):
-    """Updates DNS records for a domain in Cloudflare."""
+    """Updates DNS records for a domain in Cloudflare. Returns True on success."""
     API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
     ZONE_ID = get_zone_id(domain)  # Get zone ID based on domain
     if not API_TOKEN or not ZONE_ID:
         print(f"Error: CLOUDFLARE_API_TOKEN or ZONE_ID not found for {domain}.")
-        return
+        return False
 
     headers = {
         "Authorization": f"Bearer {API_TOKEN}",
@@ -21,61 +85,60 @@ def update_dns_records(domain, ip_address):
     }
 
     try:
+        # One listing serves both the root and www lookups
+        records = get_a_records(ZONE_ID, headers)
+
         # Update or create A record for root domain
-        update_or_create_record(ZONE_ID, headers, domain, ip_address)
+        update_or_create_record(ZONE_ID, headers, domain, ip_address, records.get(domain))
 
         # Update or create A record for www subdomain
-        update_or_create_record(ZONE_ID, headers, f"www.{domain}", ip_address)
+        update_or_create_record(ZONE_ID, headers, f"www.{domain}", ip_address, records.get(f"www.{domain}"))
+        return True
 
     except requests.exceptions.RequestException as e:
         print(f"Error updating DNS records for {domain}: {e}")
+        return False
 
 def get_zone_id(domain):
-    """Retrieves the zone ID for a domain."""
+    """Retrieves the zone ID for a domain from the shared zone index."""
     API_TOKEN = os.getenv("CLOUDFLARE_API_TOKEN")
     if not API_TOKEN:
         print("Error: CLOUDFLARE_API_TOKEN must be set in .env file.")
         return None
 
-    url = f"https://api.cloudflare.com/client/v4/zones"
-    headers = {
-        "Authorization": f"Bearer {API_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        zones = response.json().get("result", [])
-
-        for zone in zones:
-            if zone.get("name") == domain:
-                return zone.get("id")
-
-        print(f"Zone ID not found for domain: {domain}")
-        return None  # Return None if the domain is not found
-
+        zone_id = zone_index.get_zone_id(API_TOKEN, domain, request=api_request)
     except requests.exceptions.RequestException as e:
         print(f"Error getting zone ID for {domain}: {e}")
         return None
 
-def update_or_create_record(zone_id, headers, name, ip_address):
-    """Updates or creates a DNS record."""
+    if not zone_id:
+        print(f"Zone ID not found for domain: {domain}")
+    return zone_id
 
-    # Check if a record with the same name exists
-    existing_record_id = None
+def get_a_records(zone_id, headers):
+    """Fetches all A records of a zone, following pagination. Returns {name: record}."""
+    records_url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
+    records = {}
+    page = 1
+
+    while True:
+        params = {"type": "A", "page": page, "per_page": 100}
+        data = api_request("GET", records_url, headers, params=params).json()
+        for record in data.get("result", []):
+            records.setdefault(record.get("name"), record)
+
+        result_info = data.get("result_info", {})
+        if result_info.get("page", 1) >= result_info.get("total_pages", 1):
+            break
+
+        page += 1
+
+    return records
+
+def update_or_create_record(zone_id, headers, name, ip_address, existing_record=None):
+    """Updates or creates a DNS record, given the existing A record for name if any."""
     records_url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records"
-    try:
-        records_response = requests.get(records_url, headers=headers)
-        records_response.raise_for_status()
-        existing_records = records_response.json().get("result", [])
-        for record in existing_records:
-            if record.get("name") == name and record.get("type") == "A":
-                existing_record_id = record.get("id")
-                break
-    except requests.exceptions.RequestException as e:
-        print(f"Error checking for existing records for {name}: {e}")
-        return
 
     data = {
         "type": "A",
@@ -85,21 +148,24 @@ def update_or_create_record(zone_id, headers, name, ip_address):
         "proxied": False
     }
 
-    if existing_record_id:
+    if existing_record and all(existing_record.get(key) == data[key] for key in ("content", "ttl", "proxied")):
+        print(f"A record for {name} is already up to date")
+        return
+
+    if existing_record:
         # Update existing record
-        url = f"{records_url}/{existing_record_id}"
-        method = requests.put
+        url = f"{records_url}/{existing_record['id']}"
+        method = "PUT"
         print(f"Updating A record for {name}")
 
     else:
         # Create new record
         url = records_url
-        method = requests.post
+        method = "POST"
         print(f"Creating A record for {name}")
 
 
-    response = method(url, headers=headers, json=data)
-    response.raise_for_status()
+    response = api_request(method, url, headers, json=data)
     print(f"DNS update/creation for {name}: {response.json()}")
 
 
@@ -115,16 +181,29 @@ def main():
 
     try:
         with open(DOMAINS_FILE, "r") as f:
-            domains = [line.strip() for line in f]
+            domains = [line.strip() for line in f if line.strip()]
     except FileNotFoundError:
         print(f"Error: Domains file '{DOMAINS_FILE}' not found.")
         return
 
-    for domain in domains:
-        update_dns_records(domain, IP_ADDRESS)
-        time.sleep(1)  # Small delay to avoid rate limiting
+    # Load the zone index once, before the workers share it
+    try:
+        zone_index.load_zones(API_TOKEN, request=api_request)
+    except requests.exceptions.RequestException as e:
+        print(f"Error listing zones: {e}")
+        return
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = list(executor.map(lambda domain: update_dns_records(domain, IP_ADDRESS), domains))
+
+    elapsed = time.monotonic() - start
+    print(
+        f"Updated {sum(results)} of {len(domains)} domains in {elapsed:.1f}s"
+        f" ({len(domains) / elapsed if elapsed else 0:.1f} domains/sec)"
+    )
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
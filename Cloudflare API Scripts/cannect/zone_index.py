@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+
+# Shared zone name -> zone ID index for the scripts in this folder
+BASE_URL = "https://api.cloudflare.com/client/v4"
+ZONE_CACHE_FILE = "zones_cache.json"
+ZONE_CACHE_TTL = 3600  # Seconds before the cached index is fetched again
+PER_PAGE = 50  # Zones per page when listing; Cloudflare allows up to 50
+
+_zones = {}  # token digest -> (zones, fetched this run), so the cache file is read once per process
+_lock = threading.RLock()  # Lookups may come from several threads; only one refetches
+
+def token_digest(api_token):
+    """Cache entries are tied to the token, so switching accounts never serves the wrong zones."""
+    return hashlib.sha256(api_token.encode("utf-8")).hexdigest()[:16]
+
+def send_request(method, url, headers, **kwargs):
+    """Default request function; scripts with a rate limiter pass their own."""
+    return requests.request(method, url, headers=headers, **kwargs)
+
+def fetch_zones(api_token, request=send_request):
+    """
+    Fetches every zone in the account, following all pages. Returns {name: id}.
+    request(method, url, headers, **kwargs) sends each page request.
+    """
+    url = f"{BASE_URL}/zones"
+    headers = {
+        "Authorization": f"Bearer {api_token}",
+        "Content-Type": "application/json"
+    }
+    zones = {}
+    page = 1
+
+    while True:
+        params = {"page": page, "per_page": PER_PAGE}
+        response = request("GET", url, headers, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        for zone in data.get("result", []):
+            zones[zone["name"]] = zone["id"]
+
+        # Check if there are more pages
+        result_info = data.get("result_info", {})
+        if result_info.get("page", 1) >= result_info.get("total_pages", 1):
+            break
+
+        page += 1
+
+    return zones
+
+def load_zones(api_token, refresh=False, request=send_request):
+    """
+    Returns the zone index, from ZONE_CACHE_FILE while it is younger than
+    ZONE_CACHE_TTL, otherwise fetched from the API and written back.
+    """
+    with _lock:
+        digest = token_digest(api_token)
+        if not refresh and digest in _zones:
+            return _zones[digest][0]
+
+        if not refresh:
+            try:
+                with open(ZONE_CACHE_FILE, "r") as f:
+                    cache = json.load(f)
+                if cache.get("token") == digest and time.time() - cache.get("fetched_at", 0) < ZONE_CACHE_TTL:
+                    _zones[digest] = (cache["zones"], False)
+                    return cache["zones"]
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+
+        zones = fetch_zones(api_token, request)
+        _zones[digest] = (zones, True)
+        with open(f"{ZONE_CACHE_FILE}.tmp", "w") as f:
+            json.dump({"token": digest, "fetched_at": time.time(), "zones": zones}, f)
+        os.replace(f"{ZONE_CACHE_FILE}.tmp", ZONE_CACHE_FILE)
+        return zones
+
+def get_zone_id(api_token, domain, request=send_request):
+    """
+    Looks up a domain's zone ID. A miss in an index read from the cache
+    refetches it once, in case the zone was added since it was written.
+    """
+    with _lock:
+        zones = load_zones(api_token, request=request)
+        if domain not in zones and not _zones[token_digest(api_token)][1]:
+            zones = load_zones(api_token, refresh=True, request=request)
+        return zones.get(domain)
+
+def invalidate_zones():
+    """Drops the cached index; call after adding a zone."""
+    with _lock:
+        _zones.clear()
+        try:
+            os.remove(ZONE_CACHE_FILE)
+        except FileNotFoundError:
+            pass
@@ -1,4 +1,11 @@
+import io
 import os
+import json
+import math
+import time
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
 
 # Define paths
@@ -7,35 +14,300 @@ output_folder = "output"
 max_size_kb = 240  # Max file size in KB
 max_size_bytes = max_size_kb * 1024  # Convert KB to bytes
 
-# Ensure output directory exists
-os.makedirs(output_folder, exist_ok=True)
+# Quality search settings
+max_quality = 85  # Highest JPEG quality tried
+min_quality = 5  # Lowest JPEG quality tried before giving up on quality alone
+allow_downscale = True  # Shrink the image when even min_quality is over max_size_kb
+min_scale = 0.25  # Never shrink below this fraction of the original dimensions
+
+# Decode settings
+max_dimension = None
+
+# Batch settings
+workers = os.cpu_count() or 1  # Worker processes compressing in parallel
+max_in_flight = workers * 2  # Images queued or decoding at once; caps memory with huge images
+image_extensions = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp")
+
+# Results of previous runs, keyed by input content hash plus the settings above
+manifest_file = "compress_manifest.jsonl"
+manifest_by_hash = {}  # Loaded in each worker by load_manifest()
+
+def settings_key():
+    key = f"{max_size_kb}kb q{min_quality}-{max_quality} downscale={allow_downscale} min_scale={min_scale}"
+    return f"{key} max_dimension={max_dimension}" if max_dimension else key
+
+def open_capped(img):
+    """
+    Load an opened image with its longest side capped at max_dimension.
+
+    JPEGs use draft mode, so libjpeg decodes straight at 1/2, 1/4 or 1/8 scale
+    and the full-resolution pixels never exist in memory. Other formats are
+    shrunk by an integer reduce() right after decoding, before any conversion.
+    """
+    if not max_dimension or max(img.size) <= max_dimension:
+        return img
+    if img.format == "JPEG":
+        # The box keeps the image's aspect ratio; draft() scales by the tighter side
+        scale = max_dimension / max(img.size)
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    factor = max(img.size) // max_dimension
+    if factor > 1:
+        img = img.reduce(factor)
+    if max(img.size) > max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return img
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_manifest():
+    """
+    Return all manifest entries, oldest first. A torn last line is ignored.
+    """
+    entries = []
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+def load_manifest():
+    """
+    Worker initializer: index previous results by input hash.
+    """
+    for entry in read_manifest():
+        manifest_by_hash.setdefault(entry["input_sha256"], []).append(entry)
+
+def output_matches(entry):
+    path = os.path.join(output_folder, entry["filename"])
+    return os.path.exists(path) and os.path.getsize(path) == entry["output_bytes"]
+
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def search_quality(img, low=min_quality, high=max_quality, hint=None):
+    """
+    Bisect for the highest JPEG quality whose encode fits in max_size_bytes.
+
+    A hint (e.g. the quality chosen on a previous run) is probed first along
+    with its neighbour, so an unchanged or slightly changed target usually
+    settles in two encodes.
+
+    Returns (data, quality, encodes). If nothing fits, data is the smallest encode.
+    """
+    best = None
+    smallest = None
+    encodes = 0
+
+    def probe(quality):
+        nonlocal best, smallest, encodes
+        data = encode_jpeg(img, quality)
+        encodes += 1
+        if len(data) <= max_size_bytes:
+            if best is None or quality > best[1]:
+                best = (data, quality)
+            return True
+        if smallest is None or len(data) < len(smallest[0]):
+            smallest = (data, quality)
+        return False
+
+    first = high if hint is None else min(max(hint, low), high)
+    if probe(first):
+        low = first + 1
+        if hint is not None and low <= high:
+            if not probe(low):
+                high = low - 1
+            low += 1
+    else:
+        high = first - 1
+        if hint is not None and low <= high:
+            if probe(high):
+                low = high + 1
+            high -= 1
+
+    while low <= high:
+        quality = (low + high) // 2
+        if probe(quality):
+            low = quality + 1
+        else:
+            high = quality - 1
+    data, quality = best or smallest
+    return data, quality, encodes
 
 # Function to compress images
-def compress_image(input_path, output_path):
+def compress_image(input_path, output_path, hint_quality=None, hint_scale=1.0):
     with Image.open(input_path) as img:
         img_format = img.format  # Preserve original format
+        img = open_capped(img)
         img = img.convert("RGB") if img_format in ["JPEG", "JPG", "PNG"] else img
 
-        # Initial quality setting
-        quality = 85
-        step = 5  # Step to reduce quality iteratively
-
         # Resize to reduce size while maintaining aspect ratio
         width, height = img.size
-        while True:
-            img.save(output_path, format="JPEG", quality=quality, optimize=True)
-            if os.path.getsize(output_path) <= max_size_bytes or quality < 10:
-                break
-            quality -= step
+        scale = hint_scale if allow_downscale else 1.0
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            candidate = img.resize(size, Image.LANCZOS)
+        else:
+            candidate = img
+
+        # Encode into memory and bisect over quality
+        data, quality, encodes = search_quality(candidate, hint=hint_quality)
+
+        # The hinted scale is only a starting point: if the full-size image now
+        # fits at min_quality, search it instead, as a run without a hint would
+        if scale < 1.0 and len(data) <= max_size_bytes:
+            probe = encode_jpeg(img, min_quality)
+            encodes += 1
+            if len(probe) <= max_size_bytes:
+                data, quality, attempts = search_quality(img)
+                encodes += attempts
+                scale = 1.0
+
+        while allow_downscale and len(data) > max_size_bytes and scale > min_scale:
+            # Encoded size is roughly proportional to pixel count
+            scale = max(min_scale, scale * math.sqrt(max_size_bytes / len(data)) * 0.95)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            data, quality, attempts = search_quality(img.resize(size, Image.LANCZOS))
+            encodes += attempts
+
+    # Only the winning encode touches the disk, replaced atomically so other
+    # workers never copy a half-written output
+    with open(f"{output_path}.tmp", "wb") as file:
+        file.write(data)
+    os.replace(f"{output_path}.tmp", output_path)
 
-        print(f"Compressed {input_path} -> {output_path} | {os.path.getsize(output_path) / 1024:.2f} KB")
+    return {"quality": quality, "scale": scale, "encodes": encodes, "output_bytes": len(data)}
 
-# Process all images in the input folder
-for filename in os.listdir(input_folder):
-    if filename.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tiff", ".webp")):
-        input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, filename)
+def compress_file(filename):
+    """
+    Worker entry point: compress one file from input_folder into output_folder.
+
+    Inputs already compressed with the current settings are skipped, or copied
+    from an identical image's output; otherwise the search starts from the
+    quality chosen for this image on a previous run.
+    """
+    input_path = os.path.join(input_folder, filename)
+    output_path = os.path.join(output_folder, filename)
+    result = {"filename": filename}
+    try:
+        stat = os.stat(input_path)
+        result.update(input_bytes=stat.st_size, input_mtime_ns=stat.st_mtime_ns)
+        sha256 = file_sha256(input_path)
+        result.update(input_sha256=sha256, settings=settings_key())
+        previous = manifest_by_hash.get(sha256, [])
+        for entry in reversed(previous):
+            if entry["settings"] == result["settings"] and output_matches(entry):
+                if entry["filename"] != filename:
+                    shutil.copyfile(os.path.join(output_folder, entry["filename"]), f"{output_path}.tmp")
+                    os.replace(f"{output_path}.tmp", output_path)
+                result.update(status="skipped" if entry["filename"] == filename else "copied",
+                              quality=entry["quality"], scale=entry["scale"], encodes=0,
+                              output_bytes=entry["output_bytes"])
+                return result
+        # Prefer the quality chosen for these exact settings, else the latest one;
+        # a scale only carries over when the settings it was chosen under match
+        same_settings = [entry for entry in previous if entry["settings"] == result["settings"]]
+        hint = (same_settings or previous or [{}])[-1]
+        hint_scale = same_settings[-1]["scale"] if same_settings else 1.0
+        result.update(compress_image(input_path, output_path, hint.get("quality"), hint_scale))
+        result["status"] = "compressed"
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def report(index, total, result):
+    input_path = os.path.join(input_folder, result["filename"])
+    output_path = os.path.join(output_folder, result["filename"])
+    if "error" in result:
+        print(f"[{index}/{total}] Error compressing {input_path}: {result['error']}")
+        return
+    if result["status"] != "compressed":
+        print(f"[{index}/{total}] Unchanged, {result['status']} {output_path} | {result['output_bytes'] / 1024:.2f} KB")
+        return
+    print(
+        f"[{index}/{total}] Compressed {input_path} -> {output_path} | {result['output_bytes'] / 1024:.2f} KB"
+        f" | quality {result['quality']} | scale {result['scale']:.2f} | {result['encodes']} encodes"
+    )
+
+def main():
+    # Ensure output directory exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Files whose size, mtime and settings match their last entry skip even hashing
+    latest = {entry["filename"]: entry for entry in read_manifest()}
+    filenames = []
+    skipped = 0
+    for filename in sorted(f for f in os.listdir(input_folder) if f.lower().endswith(image_extensions)):
+        stat = os.stat(os.path.join(input_folder, filename))
+        entry = latest.get(filename)
+        if (entry and entry["input_bytes"] == stat.st_size and entry["input_mtime_ns"] == stat.st_mtime_ns
+                and entry["settings"] == settings_key() and output_matches(entry)):
+            skipped += 1
+            continue
+        filenames.append(filename)
+    if skipped:
+        print(f"Skipping {skipped} unchanged images already in {manifest_file}")
+    total = len(filenames)
+    results = {}  # Finished results waiting for earlier files, so progress prints in order
+    next_index = 0
+    bytes_in = bytes_out = failed = 0
+    start = time.perf_counter()
+
+    # Process all images in the input folder, keeping at most max_in_flight submitted
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_manifest) as executor, \
+            open(manifest_file, "a", encoding="utf-8") as manifest:
+        running = {}
+        queue = iter(enumerate(filenames))
+        while True:
+            for index, filename in queue:
+                running[executor.submit(compress_file, filename)] = index
+                if len(running) >= max_in_flight:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    # The worker itself failed, e.g. it was killed; count it like any other error
+                    results[index] = {"filename": filenames[index], "error": str(e) or type(e).__name__}
+            while next_index in results:
+                result = results.pop(next_index)
+                next_index += 1
+                report(next_index, total, result)
+                if "error" in result:
+                    failed += 1
+                    continue
+                bytes_in += result["input_bytes"]
+                bytes_out += result["output_bytes"]
+                if result["status"] != "skipped":
+                    manifest.write(json.dumps({key: result[key] for key in (
+                        "filename", "input_sha256", "input_bytes", "input_mtime_ns", "settings",
+                        "quality", "scale", "output_bytes",
+                    )}) + "\n")
+                    manifest.flush()
 
-        compress_image(input_path, output_path)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Compression complete. Check the '{output_folder}' folder.\n"
+        f"{total - failed} images in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} images/sec)"
+        f" with {workers} workers | {failed} failed"
+        f" | {bytes_in / 1024 / 1024:.1f} MB -> {bytes_out / 1024 / 1024:.1f} MB"
+        f" | saved {(bytes_in - bytes_out) / 1024 / 1024:.1f} MB"
+    )
 
-print("Compression complete. Check the 'output' folder.")
+if __name__ == "__main__":
+    main()
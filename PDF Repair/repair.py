@@ -1,98 +1,315 @@
+import io
 import fitz  # PyMuPDF
 import pikepdf
 import os
+import re
+import json
+import time
+import shutil
 import subprocess
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # Folder paths
 INPUT_FOLDER = "originals"
 OUTPUT_FOLDER = "fixed"
-LOG_FILE = "repair_log.txt"
+RESULTS_FILE = "repair_results.jsonl"  # One JSON outcome per repair attempt
 
-# Ensure output folder exists
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Batch settings
+WORKERS = os.cpu_count() or 1  # Files repaired in parallel, each in its own process
+TIMEOUT = 300  # Seconds before a repair attempt is killed
+MEMORY_LIMIT_MB = 4096  # Address space cap per worker process; None to disable
 
-def repair_pdf(input_pdf, output_pdf):
-    try:
-        print(f"Processing: {input_pdf}")
+# Triage settings
+TAIL_BYTES = 2048  # Bytes read from the end of each file to find startxref and %%EOF
+LINK_HEALTHY = True  # Hard-link healthy files into OUTPUT_FOLDER; False to copy them
+
+def no_stage(stage):
+    pass
+
+def triage_pdf(input_pdf):
+    """
+    Cheaply classify input_pdf as "healthy", "structural" or "content" damaged.
+
+    Checks the header, %%EOF and that startxref points at an xref table or
+    stream using only the first and last bytes of the file, then opens it with
+    PyMuPDF to catch xrefs MuPDF had to rebuild, missing pages and page
+    objects or content streams that fail to parse. Returns (health, reason).
+    """
+    size = os.path.getsize(input_pdf)
+    with open(input_pdf, "rb") as file:
+        header = file.read(8)
+        file.seek(max(0, size - TAIL_BYTES))
+        tail = file.read()
+        if not header.startswith(b"%PDF-"):
+            return "structural", "Missing %PDF header"
+        if b"%%EOF" not in tail:
+            return "structural", "Missing %%EOF marker"
+        offsets = re.findall(rb"startxref\s+(\d+)", tail)
+        if not offsets:
+            return "structural", "Missing startxref"
+        offset = int(offsets[-1])
+        if offset >= size:
+            return "structural", "startxref points past the end of the file"
+        file.seek(offset)
+        start = file.read(32)
+        if not (start.startswith(b"xref") or re.match(rb"\d+\s+\d+\s+obj", start)):
+            return "structural", "startxref does not point at an xref"
 
-        # Step 1: Try opening with pikepdf first (fixes structure issues)
+    fitz.TOOLS.mupdf_display_errors(False)  # Problems are returned as the reason instead
+    fitz.TOOLS.reset_mupdf_warnings()
+    try:
+        doc = fitz.open(input_pdf)
+    except Exception as e:
+        return "structural", str(e)
+    with doc:
+        if doc.is_repaired:
+            return "structural", "xref had to be rebuilt"
+        if doc.needs_pass:
+            return "healthy", "Encrypted; contents not checked"
+        if doc.page_count == 0:
+            return "content", "No pages found"
         try:
-            with pikepdf.open(input_pdf) as pdf:
-                recovered_pdf = os.path.join(OUTPUT_FOLDER, "temp_recovered.pdf")
-                pdf.save(recovered_pdf)
-            input_pdf = recovered_pdf  # Use the recovered file for further processing
+            for page in doc:
+                for xref in page.get_contents():
+                    doc.xref_stream(xref)
         except Exception as e:
-            print(f"Skipping {input_pdf}: Cannot open with pikepdf - {e}")
-            with open(LOG_FILE, "a") as log:
-                log.write(f"{input_pdf}: Cannot open with pikepdf - {e}\n")
-            return False
+            return "content", str(e)
+    warnings = fitz.TOOLS.mupdf_warnings()
+    if warnings:
+        return "content", warnings.splitlines()[0]
+    return "healthy", None
+
+def link_or_copy(input_pdf, output_pdf, on_stage=no_stage):
+    on_stage("link")
+    if LINK_HEALTHY:
+        try:
+            os.link(input_pdf, output_pdf)
+            return
+        except OSError:
+            pass  # Different filesystem, or links unsupported
+    shutil.copy2(input_pdf, output_pdf)
 
-        # Step 2: Open with PyMuPDF (fitz)
-        repaired_pdf = fitz.open()
-        damaged_pdf = fitz.open(input_pdf)
+def repair_pdf(input_pdf, output_pdf, on_stage=no_stage):
+    """
+    Rebuild input_pdf with pikepdf, PyMuPDF and a linearized pikepdf save.
 
+    The stages hand their results to each other as in-memory bytes, so
+    output_pdf is the only file written and files can be repaired
+    concurrently without clashing over temp files. on_stage is called with
+    the name of each stage as it starts. Raises on failure.
+    """
+    # Step 1: Try opening with pikepdf first (fixes structure issues)
+    on_stage("pikepdf")
+    recovered = io.BytesIO()
+    with pikepdf.open(input_pdf) as pdf:
+        pdf.save(recovered)
+
+    # Step 2: Open the recovered bytes with PyMuPDF (fitz) and copy all pages in one call
+    on_stage("pymupdf")
+    with fitz.open(stream=recovered.getvalue(), filetype="pdf") as damaged_pdf:
         if len(damaged_pdf) == 0:
-            print(f"Skipping {input_pdf}: No pages found.")
-            with open(LOG_FILE, "a") as log:
-                log.write(f"{input_pdf}: No pages found\n")
-            return False
+            raise ValueError("No pages found")
 
-        for page_num in range(len(damaged_pdf)):
-            repaired_pdf.insert_pdf(damaged_pdf, from_page=page_num, to_page=page_num)
+        with fitz.open() as repaired_pdf:
+            repaired_pdf.insert_pdf(damaged_pdf, from_page=0, to_page=len(damaged_pdf) - 1)
+            repaired = repaired_pdf.tobytes()
+    recovered = None  # Free the step 1 bytes before linearizing
 
-        temp_pdf = os.path.join(OUTPUT_FOLDER, "temp_repaired.pdf")
-        repaired_pdf.save(temp_pdf)
-        repaired_pdf.close()
-        damaged_pdf.close()
+    # Step 3: Optimize with pikepdf
+    on_stage("linearize")
+    with pikepdf.open(io.BytesIO(repaired)) as pdf:
+        pdf.save(output_pdf, linearize=True)
 
-        # Step 3: Optimize with pikepdf
-        with pikepdf.open(temp_pdf) as pdf:
-            pdf.save(output_pdf, linearize=True)
+def repair_with_mutool(input_pdf, output_pdf, on_stage=no_stage):
+    # Ensure mutool is installed and available in PATH
+    on_stage("mutool")
+    subprocess.run(["mutool", "clean", input_pdf, output_pdf], check=True, capture_output=True, timeout=TIMEOUT)
 
-        os.remove(temp_pdf)
-        print(f"✅ Repaired and saved: {output_pdf}")
-        return True
+# Repair methods in the order they are tried; each failure schedules the next
+METHODS = {"pikepdf": repair_pdf, "mutool": repair_with_mutool}
 
-    except Exception as e:
-        print(f"❌ Error processing {input_pdf}: {e}")
-        with open(LOG_FILE, "a") as log:
-            log.write(f"{input_pdf}: {e}\n")
-        return False
+def run_attempt(method, input_pdf, output_pdf, conn, triage=False):
+    """
+    Worker process entry point: run one repair method and report over conn.
 
-def repair_with_mutool(input_pdf, output_pdf):
+    With triage, the file is classified first and sent as ("health",
+    (health, reason)); healthy files are linked or copied through instead of
+    repaired. Sends ("stage", name) as stages start, then ("done", None) or
+    ("error", message). The output is written to a .part file and only
+    renamed into place on success, so a killed worker never leaves a
+    truncated PDF behind.
+    """
+    if resource is not None and MEMORY_LIMIT_MB:
+        limit = MEMORY_LIMIT_MB * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError):
+            pass  # Not supported everywhere (e.g. macOS); run without the cap
+    on_stage = lambda stage: conn.send(("stage", stage))
     try:
-        print(f"🔄 Attempting secondary repair with mutool: {input_pdf}")
+        if os.path.exists(f"{output_pdf}.part"):
+            os.remove(f"{output_pdf}.part")
+        repair = METHODS[method]
+        if triage:
+            on_stage("triage")
+            health, reason = triage_pdf(input_pdf)
+            conn.send(("health", (health, reason)))
+            if health == "healthy":
+                repair = link_or_copy
+        repair(input_pdf, f"{output_pdf}.part", on_stage)
+        os.replace(f"{output_pdf}.part", output_pdf)
+        conn.send(("done", None))
+    except MemoryError:
+        conn.send(("error", f"Out of memory (limit {MEMORY_LIMIT_MB} MB)"))
+    except Exception as e:
+        if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+            e = e.stderr.decode(errors="replace").strip().splitlines()[-1]
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
 
-        # Ensure mutool is installed and available in PATH
-        mutool_output = os.path.join(OUTPUT_FOLDER, os.path.basename(output_pdf))
-        subprocess.run(["mutool", "clean", input_pdf, mutool_output], check=True)
+def start_attempt(filename, method, triage=False):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=run_attempt,
+        args=(method, os.path.join(INPUT_FOLDER, filename), os.path.join(OUTPUT_FOLDER, filename), sender, triage),
+        daemon=True,
+    )
+    process.start()
+    sender.close()  # The worker holds the only sending end, so its exit shows up as EOF
+    return {"file": filename, "method": method, "stage": None, "status": None, "error": None, "health": None,
+            "start": time.perf_counter(), "process": process, "conn": receiver}
 
-        print(f"✅ Successfully repaired using mutool: {mutool_output}")
-        return True
+def finish_attempt(attempt, status, error=None):
+    attempt["conn"].close()
+    attempt["process"].join(timeout=5)
+    if attempt["process"].is_alive():
+        attempt["process"].kill()
+        attempt["process"].join()
+    part = os.path.join(OUTPUT_FOLDER, f"{attempt['file']}.part")
+    if os.path.exists(part):
+        os.remove(part)
+    attempt.update(status=status, error=error)
+    return {
+        "file": attempt["file"],
+        "method": attempt["method"],
+        "status": status,
+        "stage": attempt["stage"],
+        "health": attempt["health"],
+        "reason": attempt["reason"],
+        "seconds": round(time.perf_counter() - attempt["start"], 3),
+        "error": error,
+    }
 
-    except Exception as e:
-        print(f"❌ mutool repair failed for {input_pdf}: {e}")
-        with open(LOG_FILE, "a") as log:
-            log.write(f"{input_pdf}: mutool repair failed - {e}\n")
-        return False
+def report(outcome):
+    input_pdf = os.path.join(INPUT_FOLDER, outcome["file"])
+    output_pdf = os.path.join(OUTPUT_FOLDER, outcome["file"])
+    if outcome["status"] == "healthy":
+        print(f"✅ Healthy, passed through in {outcome['seconds']:.1f}s: {output_pdf}")
+    elif outcome["status"] == "repaired":
+        print(
+            f"✅ Repaired {outcome['health']} damage with {outcome['method']}"
+            f" in {outcome['seconds']:.1f}s: {output_pdf}"
+        )
+    else:
+        print(
+            f"❌ {outcome['method']} {outcome['status']} for {input_pdf} at stage {outcome['stage']}"
+            f" after {outcome['seconds']:.1f}s: {outcome['error']}"
+        )
 
 def process_folder():
-    pdf_files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(".pdf")]
+    """
+    Repair every PDF in INPUT_FOLDER, each attempt in an isolated worker process.
+
+    The first attempt for each file starts with triage_pdf, so healthy files are
+    passed through without the expensive repair stages.
+    At most WORKERS attempts run at once. An attempt that hangs past TIMEOUT is
+    killed, and one that crashes its process (e.g. a segfault in a native
+    library) is detected by its pipe closing without a result; either way the
+    next method in METHODS is queued for that file. Every attempt is appended
+    to RESULTS_FILE as a JSON line with the stage it reached and its duration.
+    """
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    pdf_files = sorted(f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(".pdf"))
 
     if not pdf_files:
-        print("No PDF files found in the 'originals' folder.")
+        print(f"No PDF files found in the '{INPUT_FOLDER}' folder.")
         return
 
-    for pdf in pdf_files:
-        input_pdf = os.path.join(INPUT_FOLDER, pdf)
-        output_pdf = os.path.join(OUTPUT_FOLDER, pdf)
+    methods = list(METHODS)
+    queue = deque((pdf, methods[0]) for pdf in pdf_files)
+    running = {}  # conn -> attempt
+    health = {}  # file -> (health, reason) from triage, carried over to fallback attempts
+    healthy = repaired = failed = 0
+    start = time.perf_counter()
+
+    with open(RESULTS_FILE, "a", encoding="utf-8") as results:
+        while queue or running:
+            while queue and len(running) < WORKERS:
+                filename, method = queue.popleft()
+                attempt = start_attempt(filename, method, triage=filename not in health)
+                attempt["health"], attempt["reason"] = health.get(filename, (None, None))
+                running[attempt["conn"]] = attempt
+
+            now = time.perf_counter()
+            deadline = min(attempt["start"] + TIMEOUT for attempt in running.values())
+            finished = []
+            for conn in wait(list(running), timeout=max(0, deadline - now)):
+                attempt = running[conn]
+                try:
+                    kind, value = conn.recv()
+                except EOFError:
+                    attempt["process"].join(timeout=5)
+                    exitcode = attempt["process"].exitcode
+                    finished.append(finish_attempt(attempt, "crashed", f"Worker exited with code {exitcode}"))
+                    continue
+                if kind == "stage":
+                    attempt["stage"] = value
+                elif kind == "health":
+                    attempt["health"], attempt["reason"] = health[attempt["file"]] = value
+                elif kind == "done":
+                    status = "healthy" if attempt["stage"] == "link" else "repaired"
+                    finished.append(finish_attempt(attempt, status))
+                else:
+                    finished.append(finish_attempt(attempt, "failed", value))
+
+            now = time.perf_counter()
+            for attempt in running.values():
+                if attempt["status"] is None and now - attempt["start"] >= TIMEOUT:
+                    attempt["process"].kill()
+                    finished.append(finish_attempt(attempt, "timeout", f"No result after {TIMEOUT}s"))
 
-        # Primary repair using pikepdf and PyMuPDF
-        success = repair_pdf(input_pdf, output_pdf)
+            running = {conn: attempt for conn, attempt in running.items() if attempt["status"] is None}
+            for outcome in finished:
+                health.setdefault(outcome["file"], (None, None))  # Triage runs at most once per file
+                report(outcome)
+                results.write(json.dumps(outcome) + "\n")
+                results.flush()
+                if outcome["status"] == "healthy":
+                    healthy += 1
+                    continue
+                if outcome["status"] == "repaired":
+                    repaired += 1
+                    continue
+                next_index = methods.index(outcome["method"]) + 1
+                if next_index < len(methods):
+                    # Fallbacks jump the queue so a file's attempts finish close together
+                    queue.appendleft((outcome["file"], methods[next_index]))
+                else:
+                    failed += 1
 
-        # If primary repair fails, try mutool clean
-        if not success:
-            repair_with_mutool(input_pdf, output_pdf)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Repair complete: {healthy} healthy, {repaired} repaired, {failed} failed, {len(pdf_files)} files"
+        f" in {elapsed:.1f}s with {WORKERS} workers. Outcomes appended to {RESULTS_FILE}"
+    )
 
 if __name__ == "__main__":
     process_folder()
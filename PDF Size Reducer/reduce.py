@@ -1,37 +1,278 @@
 import os
+import json
+import time
+import shutil
+import hashlib
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import fitz  # PyMuPDF, for page counts and merging shards
 
-def compress_pdf(input_pdf, output_pdf, quality="/ebook"):
+WORKERS = os.cpu_count() or 1  # Ghostscript processes run at once (capped to CPU count)
+TIMEOUT = 300  # Seconds before a gs process is considered hung and killed
+RETRIES = 1  # Extra attempts after a timeout
+
+# Results of previous runs, so reruns over a growing archive only process new files
+MANIFEST_FILE = "reduce_manifest.jsonl"
+
+# Large PDFs are split into page ranges compressed concurrently, then merged
+SHARD_PAGES = 100  # Minimum pages per shard; files need at least 2 shards' worth
+
+# Target-size mode: set one of these to search for the best setting that fits
+TARGET_BYTES = None  # e.g. 2 * 1024 * 1024 for at most 2 MB per file
+TARGET_RATIO = None  # e.g. 0.5 for at most half the original size
+
+def dpi_args(dpi):
+    """Ghostscript flags that downsample color and gray images to dpi (mono images to 4x dpi)."""
+    return [
+        '-dDownsampleColorImages=true', f'-dColorImageResolution={dpi}',
+        '-dDownsampleGrayImages=true', f'-dGrayImageResolution={dpi}',
+        '-dDownsampleMonoImages=true', f'-dMonoImageResolution={dpi * 4}',
+    ]
+
+# Settings tried in target-size mode, highest quality first
+CANDIDATES = [
+    ("/printer", []),  # 300 dpi
+    ("/ebook", dpi_args(200)),
+    ("/ebook", []),  # 150 dpi
+    ("/ebook", dpi_args(100)),
+    ("/screen", []),  # 72 dpi
+    ("/screen", dpi_args(50)),
+]
+
+def run_gs(input_pdf, output_pdf, quality, extra_args=(), timeout=None, on_start=None):
     """
-    Compress a PDF file using Ghostscript.
+    Run Ghostscript once, killing it after timeout seconds.
 
-    Parameters:
-      input_pdf (str): The path to the input PDF file.
-      output_pdf (str): The path to the output compressed PDF file.
-      quality (str): Ghostscript quality setting.
-          Options:
-            - /screen: low-resolution output (smallest file, may reduce readability for print)
-            - /ebook: medium-resolution output (good balance for on-screen reading)
-            - /printer: high-resolution output (larger file size, best for printing)
-            - /prepress: highest quality output (largest file size)
+    on_start(process) is called with the running Popen so callers can kill it early.
+    Raises subprocess.CalledProcessError or subprocess.TimeoutExpired on failure.
     """
     command = [
         'gs',  # Ghostscript command
         '-sDEVICE=pdfwrite',
         '-dCompatibilityLevel=1.4',
         f'-dPDFSETTINGS={quality}',  # Using /ebook for smaller file size while keeping text clear
+        *extra_args,
         '-dNOPAUSE',
         '-dQUIET',
         '-dBATCH',
         f'-sOutputFile={output_pdf}',
         input_pdf
     ]
+    process = subprocess.Popen(command)
+    if on_start:
+        on_start(process)
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+def compress_pdf(input_pdf, output_pdf, quality="/ebook", timeout=None, pages=None):
+    """
+    Compress a PDF file using Ghostscript.
+
+    Parameters:
+      input_pdf (str): The path to the input PDF file.
+      output_pdf (str): The path to the output compressed PDF file.
+      quality (str): Ghostscript quality setting.
+          Options:
+            - /screen: low-resolution output (smallest file, may reduce readability for print)
+            - /ebook: medium-resolution output (good balance for on-screen reading)
+            - /printer: high-resolution output (larger file size, best for printing)
+            - /prepress: highest quality output (largest file size)
+      timeout (float): Seconds to wait before killing gs. None waits forever.
+      pages (tuple): Optional 1-based (first, last) page range to compress.
 
+    Returns True on success. Raises subprocess.TimeoutExpired if gs was killed.
+    """
+    # Write to a temporary name so a killed gs never leaves a truncated output
+    partial_pdf = f"{output_pdf}.part"
     try:
-        subprocess.run(command, check=True)
-        print(f"Successfully compressed: {input_pdf} -> {output_pdf}")
+        extra_args = [f'-dFirstPage={pages[0]}', f'-dLastPage={pages[1]}'] if pages else []
+        run_gs(input_pdf, partial_pdf, quality, extra_args, timeout=timeout)
+        os.replace(partial_pdf, output_pdf)
+        page_note = f" (pages {pages[0]}-{pages[1]})" if pages else ""
+        print(f"Successfully compressed: {input_pdf}{page_note} -> {output_pdf}")
+        return True
     except subprocess.CalledProcessError as e:
         print(f"Error compressing {input_pdf}: {e}")
+        return False
+    finally:
+        if os.path.exists(partial_pdf):
+            os.remove(partial_pdf)
+
+def compress_with_retries(input_pdf, output_pdf, quality="/ebook", timeout=TIMEOUT, retries=RETRIES, pages=None):
+    """
+    Run compress_pdf, killing and retrying hung Ghostscript processes.
+
+    Returns a result dict with the outcome, attempts, time spent and sizes.
+    """
+    start = time.perf_counter()
+    result = {"input": input_pdf, "output": output_pdf, "attempts": 0, "status": "failed",
+              "bytes_in": os.path.getsize(input_pdf), "bytes_out": 0}
+    for attempt in range(1 + retries):
+        result["attempts"] = attempt + 1
+        try:
+            if compress_pdf(input_pdf, output_pdf, quality=quality, timeout=timeout, pages=pages):
+                result["status"] = "compressed"
+                result["bytes_out"] = os.path.getsize(output_pdf)
+            break
+        except subprocess.TimeoutExpired:
+            print(f"Timed out after {timeout}s, killed gs: {input_pdf} (attempt {attempt + 1}/{1 + retries})")
+            result["status"] = "timeout"
+        except OSError as e:
+            print(f"Error compressing {input_pdf}: {e}")  # e.g. gs is not installed
+            break
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def page_ranges(page_count, shards):
+    """Split pages 1..page_count into `shards` contiguous, near-equal (first, last) ranges."""
+    size, extra = divmod(page_count, shards)
+    ranges, first = [], 1
+    for i in range(shards):
+        last = first + size - 1 + (i < extra)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+def merge_shards(input_pdf, shard_pdfs, output_pdf):
+    """
+    Concatenate compressed shards into one PDF.
+
+    insert_pdf() carries pages but not the outline or metadata, so both are
+    copied from input_pdf; shards keep its page order, so bookmarks still
+    point at the right pages. garbage=4 merges byte-identical objects
+    (shared images, fonts, ICC profiles) that each shard embedded
+    separately; deflate recompresses any uncompressed streams.
+    """
+    with fitz.open() as merged:
+        for shard_pdf in shard_pdfs:
+            with fitz.open(shard_pdf) as shard:
+                merged.insert_pdf(shard)
+        with fitz.open(input_pdf) as source:
+            merged.set_toc(source.get_toc(simple=False))
+            merged.set_metadata(source.metadata)
+        merged.save(f"{output_pdf}.part", garbage=4, deflate=True)
+    os.replace(f"{output_pdf}.part", output_pdf)
+
+def compress_to_target(input_pdf, output_pdf, target_bytes, workers=len(CANDIDATES), timeout=TIMEOUT):
+    """
+    Find the highest-quality setting in CANDIDATES whose output fits in target_bytes.
+
+    Candidates run in parallel. As soon as one fits and every higher-quality
+    candidate has finished without fitting, the lower-quality ones still
+    running are killed. If nothing fits, the smallest output is kept, and the
+    original is copied through unchanged if no candidate is smaller than it.
+    """
+    start = time.perf_counter()
+    bytes_in = os.path.getsize(input_pdf)
+    result = {"input": input_pdf, "output": output_pdf, "attempts": 0, "status": "failed",
+              "bytes_in": bytes_in, "bytes_out": 0, "setting": None}
+
+    if bytes_in <= target_bytes:
+        shutil.copyfile(input_pdf, output_pdf)
+        result.update(status="kept original", bytes_out=bytes_in, seconds=time.perf_counter() - start)
+        print(f"Already under target, kept original: {input_pdf}")
+        return result
+
+    paths = [f"{output_pdf}.candidate{i}.part" for i in range(len(CANDIDATES))]
+    sizes = {}  # Candidate index -> output size, or None if it failed
+    processes = {}
+    cancelled = set()
+    lock = threading.Lock()
+
+    def register(i, process):
+        with lock:
+            processes[i] = process
+            if i in cancelled:
+                process.kill()
+
+    def attempt(i):
+        with lock:
+            if i in cancelled:
+                return i, None
+        quality, extra_args = CANDIDATES[i]
+        try:
+            run_gs(input_pdf, paths[i], quality, extra_args, timeout, lambda process: register(i, process))
+            return i, os.path.getsize(paths[i])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+            return i, None
+
+    winner = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in as_completed([executor.submit(attempt, i) for i in range(len(CANDIDATES))]):
+            i, size = future.result()
+            sizes[i] = size
+            result["attempts"] += i not in cancelled
+            fitting = [j for j, size in sizes.items() if size is not None and size <= target_bytes]
+            if fitting and all(j in sizes for j in range(min(fitting))):
+                winner = min(fitting)
+                with lock:
+                    for j in range(winner + 1, len(CANDIDATES)):
+                        cancelled.add(j)
+                        if j in processes:
+                            processes[j].kill()
+                break
+
+    if winner is None:
+        finished = [i for i, size in sizes.items() if size is not None]
+        winner = min(finished, key=lambda i: sizes[i]) if finished else None
+        if winner is not None and sizes[winner] >= bytes_in:
+            winner = None
+    if winner is not None:
+        os.replace(paths[winner], output_pdf)
+        quality, extra_args = CANDIDATES[winner]
+        dpi = next((arg.split("=")[1] for arg in extra_args if arg.startswith("-dColorImageResolution")), None)
+        result.update(status="compressed", bytes_out=sizes[winner], setting=quality + (f" @ {dpi} dpi" if dpi else ""))
+        hit = "hit target" if sizes[winner] <= target_bytes else "missed target, smallest kept"
+        print(f"Successfully compressed: {input_pdf} -> {output_pdf} with {result['setting']} ({hit})")
+    elif sizes and any(size is not None for size in sizes.values()):
+        # Every candidate came out bigger than the input; don't ship a "compressed" file that is larger
+        shutil.copyfile(input_pdf, output_pdf)
+        result.update(status="kept original", bytes_out=bytes_in)
+        print(f"No setting beat the original, kept it: {input_pdf}")
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_key():
+    """Describe the Ghostscript settings that decide a file's output."""
+    if TARGET_BYTES is not None or TARGET_RATIO is not None:
+        candidates = hashlib.sha256(repr(CANDIDATES).encode()).hexdigest()[:12]
+        return f"target bytes={TARGET_BYTES} ratio={TARGET_RATIO} candidates={candidates}"
+    return "/ebook"
+
+def read_manifest():
+    """
+    Return the latest manifest entry per input hash, and per input path.
+    """
+    by_hash, by_path = {}, {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn line from an interrupted run
+                by_hash[(entry["input_sha256"], entry["settings"])] = entry
+                by_path[entry["input"]] = entry
+    except FileNotFoundError:
+        pass
+    return by_hash, by_path
 
 def main():
     input_folder = 'input'
@@ -41,17 +282,156 @@ def main():
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Iterate over all PDF files in the input folder
+    # Collect all PDF files in the input folder
+    jobs = []
     for filename in os.listdir(input_folder):
         if filename.lower().endswith('.pdf'):
             input_pdf_path = os.path.join(input_folder, filename)
             basename = os.path.splitext(filename)[0]
             output_pdf_filename = f"{basename}-compressed.pdf"
             output_pdf_path = os.path.join(output_folder, output_pdf_filename)
+            jobs.append((input_pdf_path, output_pdf_path))
+
+    # Run up to WORKERS Ghostscript processes at once; gs is single-threaded,
+    # so more workers than CPUs only adds contention
+    workers = max(1, min(WORKERS, os.cpu_count() or 1))
+    target_mode = TARGET_BYTES is not None or TARGET_RATIO is not None
+    # In target mode each file runs several candidates at once; split the CPUs between files
+    candidate_workers = min(workers, len(CANDIDATES))
+    file_workers = max(1, workers // candidate_workers) if target_mode else workers
+    start = time.perf_counter()
+    results = []
+    shards = {}  # output path -> bookkeeping for a file split into page-range shards
+
+    # Skip files already processed with the current settings. A matching
+    # size and mtime skips without hashing; otherwise the content hash decides.
+    settings = settings_key()
+    by_hash, by_path = read_manifest()
+    inputs = {}  # output path -> manifest fields of the input being processed
+    refreshed = []
+    skipped = 0
+    for input_pdf_path, output_pdf_path in list(jobs):
+        stat = os.stat(input_pdf_path)
+        entry = by_path.get(input_pdf_path)
+        if not (entry and entry["settings"] == settings and entry["input_bytes"] == stat.st_size
+                and entry["input_mtime_ns"] == stat.st_mtime_ns):
+            sha256 = file_sha256(input_pdf_path)
+            entry = by_hash.get((sha256, settings))
+            inputs[output_pdf_path] = {"input": input_pdf_path, "input_sha256": sha256,
+                                       "input_bytes": stat.st_size, "input_mtime_ns": stat.st_mtime_ns,
+                                       "settings": settings}
+        if entry and entry["status"] in ("compressed", "kept original"):
+            if entry["status"] == "kept original" and not os.path.exists(output_pdf_path):
+                # Compression didn't help last time; don't retry it
+                shutil.copyfile(input_pdf_path, output_pdf_path)
+            if os.path.exists(output_pdf_path):
+                skipped += 1
+                jobs.remove((input_pdf_path, output_pdf_path))
+                fresh = inputs.pop(output_pdf_path, None)
+                if fresh:
+                    # Same content under a new path or mtime; record it so the next run skips hashing
+                    refreshed.append(dict(entry, **fresh, output=output_pdf_path))
+    if skipped:
+        print(f"Skipping {skipped} files already processed with these settings ({MANIFEST_FILE})")
 
+    manifest = open(MANIFEST_FILE, "a", encoding="utf-8")
+    for entry in refreshed:
+        manifest.write(json.dumps(entry) + "\n")
+
+    def record(result):
+        if result["status"] == "compressed" and result["bytes_out"] >= result["bytes_in"]:
+            # Compression made it bigger; ship the original and remember not to retry
+            shutil.copyfile(result["input"], result["output"])
+            result.update(status="kept original", bytes_out=result["bytes_in"], worse=True)
+            print(f"Compression made {result['input']} bigger, kept the original")
+        results.append(result)
+        entry = inputs.get(result["output"])
+        if entry is None:
+            # Recorded before this run started; make sure the entry is current
+            stat = os.stat(result["input"])
+            entry = {"input": result["input"], "input_sha256": file_sha256(result["input"]),
+                     "input_bytes": stat.st_size, "input_mtime_ns": stat.st_mtime_ns, "settings": settings}
+        entry.update(output=result["output"], status=result["status"], bytes_out=result["bytes_out"],
+                     worse=result.get("worse", False))
+        manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+
+    with manifest, ThreadPoolExecutor(max_workers=file_workers) as executor:
+        futures = {}
+        for input_pdf_path, output_pdf_path in jobs:
             print(f"Compressing: {input_pdf_path} -> {output_pdf_path}")
+            if target_mode:
+                target = TARGET_BYTES if TARGET_BYTES is not None else TARGET_RATIO * os.path.getsize(input_pdf_path)
+                futures[executor.submit(
+                    compress_to_target, input_pdf_path, output_pdf_path, target, candidate_workers, TIMEOUT
+                )] = None
+                continue
+            try:
+                with fitz.open(input_pdf_path) as doc:
+                    page_count = doc.page_count
+            except Exception:
+                page_count = 0  # Let gs report the problem
+            shard_count = min(workers, page_count // SHARD_PAGES)
+            if shard_count >= 2:
+                # Queue each page range as its own job so shards of one huge
+                # file and other files all share the same worker pool
+                ranges = page_ranges(page_count, shard_count)
+                paths = [f"{output_pdf_path}.shard{i}.pdf" for i in range(shard_count)]
+                shards[output_pdf_path] = {"input": input_pdf_path, "paths": paths, "results": [],
+                                           "start": time.perf_counter()}
+                print(f"  splitting {page_count} pages into {shard_count} shards")
+                for pages, path in zip(ranges, paths):
+                    futures[executor.submit(
+                        compress_with_retries, input_pdf_path, path, "/ebook", TIMEOUT, RETRIES, pages
+                    )] = output_pdf_path
+                continue
             # Using /ebook for better compression. Adjust if needed.
-            compress_pdf(input_pdf_path, output_pdf_path, quality="/ebook")
+            futures[executor.submit(
+                compress_with_retries, input_pdf_path, output_pdf_path, "/ebook", TIMEOUT, RETRIES
+            )] = None
+        for future in as_completed(futures):
+            sharded_output = futures[future]
+            if sharded_output is None:
+                record(future.result())
+                continue
+            group = shards[sharded_output]
+            group["results"].append(future.result())
+            if len(group["results"]) < len(group["paths"]):
+                continue
+            result = {"input": group["input"], "output": sharded_output, "status": "failed",
+                      "attempts": sum(r["attempts"] for r in group["results"]),
+                      "bytes_in": os.path.getsize(group["input"]), "bytes_out": 0}
+            failed_shards = [r for r in group["results"] if r["status"] != "compressed"]
+            if failed_shards:
+                result["status"] = failed_shards[0]["status"]
+            else:
+                try:
+                    merge_shards(group["input"], group["paths"], sharded_output)
+                    result.update(status="compressed", bytes_out=os.path.getsize(sharded_output))
+                    print(f"Merged {len(group['paths'])} shards: {sharded_output}")
+                except Exception as e:
+                    print(f"Error merging shards of {group['input']}: {e}")
+                    if os.path.exists(f"{sharded_output}.part"):
+                        os.remove(f"{sharded_output}.part")
+            for path in group["paths"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            result["seconds"] = time.perf_counter() - group["start"]
+            record(result)
+
+    elapsed = time.perf_counter() - start
+    compressed = [r for r in results if r["status"] in ("compressed", "kept original")]
+    failed = [r for r in results if r not in compressed]
+    mb_in = sum(r["bytes_in"] for r in compressed) / 1024 / 1024
+    mb_out = sum(r["bytes_out"] for r in compressed) / 1024 / 1024
+    print(
+        f"\nDone: {len(compressed)} compressed ({sum(r['status'] == 'kept original' for r in results)} kept original),"
+        f" {len(failed)} failed in {elapsed:.1f}s with {workers} workers"
+        f" ({len(results) / elapsed if elapsed else 0:.2f} files/sec)"
+        f"\n{mb_in:.1f} MB in -> {mb_out:.1f} MB out"
+    )
+    for r in failed:
+        print(f"  {r['status']}: {r['input']} after {r['attempts']} attempt(s)")
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,13 @@
+import io
 import os
+import csv
+import json
+import time
+import hashlib
+from html import escape
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-import pdfkit
+import fitz  # PyMuPDF
 
 # Constants
 EMPLOYEE_NAME = "Himanshu Oberoi"
@@ -21,74 +28,346 @@ end_date = datetime(2025, 3, 20)
 num_periods = 6  # Generate last 6 pay stubs
 pay_dates = [end_date - timedelta(days=i * PAY_PERIOD) for i in range(num_periods)][::-1]
 
-# Create paystubs directory
-if not os.path.exists("paystubs"):
-    os.makedirs("paystubs")
+# Payroll mode: one row per employee pay period, in pay date order for each employee.
+# CSV with a header, or JSON lines, with employee_id, employee_name, employee_address,
+# pay_date (YYYY-MM-DD) and optionally pay, hours_worked, vacation_hours, pay_method.
+PAYROLL_FILE = None  # e.g. "payroll.csv"; None generates the single employee above
+WORKERS = os.cpu_count() or 1  # Worker processes rendering stubs in parallel
+MAX_IN_FLIGHT = WORKERS * 4  # Stubs queued or rendering at once; bounds memory on huge payrolls
+MANIFEST_FILE = "paystub_manifest.jsonl"  # Hash of each generated stub's inputs
+OUTPUT_MODE = "files"  # "files": a PDF per stub; "employee": a PDF per employee; "combined": one PDF per run
+COMBINED_FILE = "paystubs/paystubs.pdf"  # Output of the "combined" mode
+
+# Page layout for the PyMuPDF Story renderer
+PAGE_RECT = fitz.paper_rect("letter")
+CONTENT_RECT = PAGE_RECT + (36, 36, -36, -36)  # Half-inch margins
+
+# Parsed by each Story as user CSS; kept apart from the per-stub HTML below
+STYLE = """
+body { font-family: sans-serif; color: #333; }
+.container { padding: 20px; }
+h2 { text-align: center; font-size: 24px; color: #4a90e2; border-bottom: 3px solid #4a90e2; padding-bottom: 10px; }
+table { width: 100%; border-collapse: collapse; }
+th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+th { background-color: #e3efff; color: #333; font-weight: normal; text-transform: uppercase; }
+.right { text-align: right; }
+"""
+
+# Filled with str.format for every stub; only the values change between stubs
+STUB_HTML = """
+<div class="container">
+    <h2>Statement of Earnings</h2>
+    <table>
+        <tr><th>Employer</th><th>Employee</th><th>Pay Details</th></tr>
+        <tr>
+            <td><b>{company_name}</b><br>{company_address}<br>Phone: {company_phone}</td>
+            <td><b>{employee_name}</b><br>{employee_address}</td>
+            <td>
+                <b>Pay Period:</b> {period_start} to {period_end}<br>
+                <b>Pay Date:</b> {pay_date}<br>
+                <b>Pay Total:</b> ${pay:,.2f}<br>
+                <b>Paid By:</b> {pay_method}
+            </td>
+        </tr>
+    </table>
+    <h3>Earnings</h3>
+    <table>
+        <tr><th>Description</th><th class="right">Amount</th><th class="right">Year to Date</th></tr>
+        <tr><td>Gross Income</td><td class="right">${pay:,.2f}</td><td class="right">${ytd_earnings:,.2f}</td></tr>
+        <tr><td>Regular Pay</td><td class="right">${pay:,.2f}</td><td class="right">${ytd_earnings:,.2f}</td></tr>
+    </table>
+    <h3>Additional Information</h3>
+    <table>
+        <tr><th>Regular Hours Worked</th><th class="right">{hours_worked:.2f}</th></tr>
+        <tr><th>Available Vacation</th><th class="right">{vacation_hours:.2f} hours</th></tr>
+    </table>
+</div>
+"""
+
+def constant_stub(date, ytd_earnings):
+    """
+    Stub fields for the single employee described by the module constants.
+    """
+    return {
+        "employee_id": "",
+        "employee_name": EMPLOYEE_NAME,
+        "employee_address": EMPLOYEE_ADDRESS,
+        "pay_date": date.strftime('%Y-%m-%d'),
+        "pay": PAY_PER_PERIOD,
+        "ytd_earnings": ytd_earnings,
+        "hours_worked": HOURS_WORKED,
+        "vacation_hours": VACATION_HOURS,
+        "pay_method": PAY_METHOD,
+    }
+
+def stub_html(stub):
+    date = datetime.strptime(stub["pay_date"], '%Y-%m-%d')
+    return STUB_HTML.format(
+        company_name=escape(COMPANY_NAME),
+        company_address=escape(COMPANY_ADDRESS),
+        company_phone=escape(COMPANY_PHONE),
+        employee_name=escape(stub["employee_name"]),
+        employee_address=escape(stub["employee_address"]),
+        period_start=(date - timedelta(days=PAY_PERIOD - 1)).strftime('%m/%d/%Y'),
+        period_end=date.strftime('%m/%d/%Y'),
+        pay_date=date.strftime('%m/%d/%Y'),
+        pay=stub["pay"],
+        pay_method=escape(stub["pay_method"]),
+        ytd_earnings=stub["ytd_earnings"],
+        hours_worked=stub["hours_worked"],
+        vacation_hours=stub["vacation_hours"],
+    )
+
+def write_story(writer, html):
+    """
+    Lay out html onto as many pages of writer as it needs. Returns the page count.
+    """
+    story = fitz.Story(html=html, user_css=STYLE)
+    more = True
+    pages = 0
+    while more:
+        device = writer.begin_page(PAGE_RECT)
+        more, _ = story.place(CONTENT_RECT)
+        story.draw(device)
+        writer.end_page()
+        pages += 1
+    return pages
+
+def render_stub(stub, filename_pdf):
+    """
+    Render one stub to filename_pdf. Also the worker entry point in payroll mode.
+    """
+    # Render in-process with PyMuPDF; no HTML file and no wkhtmltopdf process per stub
+    writer = fitz.DocumentWriter(f"{filename_pdf}.tmp")
+    write_story(writer, stub_html(stub))
+    writer.close()
+    os.replace(f"{filename_pdf}.tmp", filename_pdf)
+    return filename_pdf
+
+def render_stubs(stubs, filename_pdf, title):
+    """
+    Render several stubs into one PDF with a bookmark per pay date.
+
+    All stubs go through one DocumentWriter, so the fonts are embedded once
+    and shared by every page rather than once per stub; when the stubs
+    belong to more than one employee, each pay date bookmark lists them.
+    The document is assembled in memory and written to disk once, with
+    garbage=4 merging any remaining duplicate objects.
+    """
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    several_employees = len({stub["employee_id"] for stub in stubs}) > 1
+    toc = []
+    page = 1
+    last_date = None
+    for stub in stubs:
+        if stub["pay_date"] != last_date:
+            toc.append([1, f"Pay date {stub['pay_date']}", page])
+            last_date = stub["pay_date"]
+        if several_employees:
+            toc.append([2, stub["employee_name"], page])
+        page += write_story(writer, stub_html(stub))
+    writer.close()
+
+    with fitz.open("pdf", buffer.getvalue()) as doc:
+        doc.set_toc(toc)
+        doc.set_metadata({"title": title, "author": COMPANY_NAME})
+        doc.save(f"{filename_pdf}.tmp", garbage=4, deflate=True)
+    os.replace(f"{filename_pdf}.tmp", filename_pdf)
+    return filename_pdf
 
 def generate_paystub(date, index, ytd_earnings):
-    filename_html = f"paystubs/paystub_{date.strftime('%Y-%m-%d')}.html"
     filename_pdf = f"paystubs/paystub_{date.strftime('%Y-%m-%d')}.pdf"
-    pay_period_start = (date - timedelta(days=13)).strftime('%m/%d/%Y')
-    pay_period_end = date.strftime('%m/%d/%Y')
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Pay Stub - {date.strftime('%B %d, %Y')}</title>
-        <style>
-            body {{ font-family: 'Inter', sans-serif; background-color: #f9faff; color: #333; max-width: 800px; margin: 20px auto; padding: 20px; }}
-            .container {{ background: #fff; padding: 20px; border-radius: 12px; box-shadow: 0 4px 10px rgba(0, 0, 0, 0.1); }}
-            h2 {{ text-align: center; font-size: 24px; color: #4a90e2; border-bottom: 3px solid #4a90e2; padding-bottom: 10px; }}
-            table {{ width: 100%; border-collapse: collapse; background: #fff; }}
-            th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
-            th {{ background-color: #e3efff; color: #333; font-weight: 400; text-transform: uppercase; letter-spacing: 0.5px; }}
-            .right {{ text-align: right; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h2>Statement of Earnings</h2>
-            <table>
-                <tr><th>Employer</th><th>Employee</th><th>Pay Details</th></tr>
-                <tr>
-                    <td><b>{COMPANY_NAME}</b><br>{COMPANY_ADDRESS}<br>Phone: {COMPANY_PHONE}</td>
-                    <td><b>{EMPLOYEE_NAME}</b><br>{EMPLOYEE_ADDRESS}</td>
-                    <td>
-                        <b>Pay Period:</b> {pay_period_start} to {pay_period_end}<br>
-                        <b>Pay Date:</b> {date.strftime('%m/%d/%Y')}<br>
-                        <b>Pay Total:</b> ${PAY_PER_PERIOD:,.2f}<br>
-                        <b>Paid By:</b> {PAY_METHOD}
-                    </td>
-                </tr>
-            </table>
-            <h3>Earnings</h3>
-            <table>
-                <tr><th>Description</th><th class="right">Amount</th><th class="right">Year to Date</th></tr>
-                <tr><td>Gross Income</td><td class="right">${PAY_PER_PERIOD:,.2f}</td><td class="right">${ytd_earnings:,.2f}</td></tr>
-                <tr><td>Regular Pay</td><td class="right">${PAY_PER_PERIOD:,.2f}</td><td class="right">${ytd_earnings:,.2f}</td></tr>
-            </table>
-            <h3>Additional Information</h3>
-            <table>
-                <tr><th>Regular Hours Worked</th><th class="right">{HOURS_WORKED:.2f}</th></tr>
-                <tr><th>Available Vacation</th><th class="right">{VACATION_HOURS:.2f} hours</th></tr>
-            </table>
-        </div>
-    </body>
-    </html>
-    """
-
-    with open(filename_html, "w", encoding="utf-8") as file:
-        file.write(html_content)
-
-    # Convert HTML to PDF using wkhtmltopdf
-    pdfkit.from_file(filename_html, filename_pdf)
+    render_stub(constant_stub(date, ytd_earnings), filename_pdf)
     print(f"Generated: {filename_pdf}")
 
-# Generate pay stubs
-ytd_earnings = 0
-for i, date in enumerate(pay_dates):
-    ytd_earnings += PAY_PER_PERIOD
-    generate_paystub(date, i, ytd_earnings)
+def generate_paystubs(pay_dates):
+    # Create paystubs directory
+    os.makedirs("paystubs", exist_ok=True)
+
+    start = time.perf_counter()
+    if OUTPUT_MODE == "files":
+        ytd_earnings = 0
+        for i, date in enumerate(pay_dates):
+            ytd_earnings += PAY_PER_PERIOD
+            generate_paystub(date, i, ytd_earnings)
+    elif OUTPUT_MODE in ("employee", "combined"):
+        # A single employee, so both modes come down to one PDF of every stub
+        stubs = [constant_stub(date, PAY_PER_PERIOD * (i + 1)) for i, date in enumerate(pay_dates)]
+        if OUTPUT_MODE == "employee":
+            filename_pdf = employee_filename({"employee_id": EMPLOYEE_NAME})
+            title = f"Pay stubs - {EMPLOYEE_NAME}"
+        else:
+            filename_pdf = COMBINED_FILE
+            title = f"Pay stubs - {COMPANY_NAME}"
+        os.makedirs(os.path.dirname(filename_pdf), exist_ok=True)
+        render_stubs(stubs, filename_pdf, title)
+        print(f"Generated: {filename_pdf}")
+    else:
+        raise ValueError(f"Unknown OUTPUT_MODE {OUTPUT_MODE!r}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(pay_dates)} pay stubs in {elapsed:.2f}s ({len(pay_dates) / elapsed if elapsed else 0:.0f} stubs/sec)")
+
+def read_payroll(path):
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.lower().endswith((".jsonl", ".json")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+def number(row, key, default):
+    """
+    A numeric payroll field. Only a missing or empty value takes the default; 0 is kept.
+    """
+    value = row.get(key)
+    return default if value in (None, "") else float(value)
+
+def iter_stubs(path):
+    """
+    Stream stub fields from a payroll file, adding each employee's YTD earnings.
+
+    Only the current year's running total per employee is kept, so memory
+    grows with the number of employees, not with the number of pay periods.
+    """
+    ytd = {}
+    for row in read_payroll(path):
+        date = datetime.strptime(str(row["pay_date"]), '%Y-%m-%d')
+        pay = number(row, "pay", PAY_PER_PERIOD)
+        employee_id = str(row["employee_id"])
+        year, total = ytd.get(employee_id, (date.year, 0))
+        total = (total if year == date.year else 0) + pay  # YTD restarts each calendar year
+        ytd[employee_id] = (date.year, total)
+        yield {
+            "employee_id": employee_id,
+            "employee_name": row["employee_name"],
+            "employee_address": row["employee_address"],
+            "pay_date": date.strftime('%Y-%m-%d'),
+            "pay": pay,
+            "ytd_earnings": total,
+            "hours_worked": number(row, "hours_worked", HOURS_WORKED),
+            "vacation_hours": number(row, "vacation_hours", VACATION_HOURS),
+            "pay_method": row.get("pay_method") or PAY_METHOD,
+        }
+
+def stub_filename(stub):
+    return f"{employee_filename(stub)[:-4]}/paystub_{stub['pay_date']}.pdf"
+
+def employee_filename(stub):
+    """
+    Readable, filesystem-safe name for an employee's output. The short hash of
+    the raw id keeps ids like "A.B" and "A/B" (or "ab" and "AB" on a
+    case-insensitive disk) from sharing a file.
+    """
+    employee = "".join(c if c.isalnum() or c in "-_" else "_" for c in stub["employee_id"])
+    digest = hashlib.sha256(stub["employee_id"].encode("utf-8")).hexdigest()[:8]
+    return f"paystubs/{employee}-{digest}.pdf"
+
+def stub_sha256(stub):
+    """
+    Hash of everything that ends up on the stub, including the template itself.
+    """
+    company = [COMPANY_NAME, COMPANY_ADDRESS, COMPANY_PHONE, PAY_PERIOD, STYLE, STUB_HTML]
+    data = json.dumps([stub, company], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def read_manifest():
+    """
+    Map each stub file to its latest input hash. A torn last line is ignored.
+    """
+    manifest = {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                manifest[entry["filename"]] = entry["sha256"]
+    except FileNotFoundError:
+        pass
+    return manifest
+
+def iter_jobs(path):
+    """
+    Yield (filename_pdf, sha256, stub count, render function, args) per output PDF.
+
+    In "files" mode stubs are streamed one job each. The "employee" and
+    "combined" modes need a whole group before it can be rendered, so they
+    hold the stub fields (not the rendered pages) in memory.
+    """
+    if OUTPUT_MODE == "files":
+        for stub in iter_stubs(path):
+            filename_pdf = stub_filename(stub)
+            yield filename_pdf, stub_sha256(stub), 1, render_stub, (stub, filename_pdf)
+        return
+
+    if OUTPUT_MODE == "combined":
+        groups = {COMBINED_FILE: sorted(iter_stubs(path), key=lambda stub: (stub["pay_date"], stub["employee_id"]))}
+    elif OUTPUT_MODE == "employee":
+        groups = {}
+        for stub in iter_stubs(path):
+            groups.setdefault(employee_filename(stub), []).append(stub)
+    else:
+        raise ValueError(f"Unknown OUTPUT_MODE {OUTPUT_MODE!r}")
+    for filename_pdf, stubs in groups.items():
+        sha256 = hashlib.sha256("".join(stub_sha256(stub) for stub in stubs).encode("ascii")).hexdigest()
+        title = f"Pay stubs - {stubs[0]['employee_name']}" if OUTPUT_MODE == "employee" else f"Pay stubs - {COMPANY_NAME}"
+        yield filename_pdf, sha256, len(stubs), render_stubs, (stubs, filename_pdf, title)
+
+def generate_from_payroll(path):
+    """
+    Render the stubs of every row of a payroll file across WORKERS processes.
+
+    OUTPUT_MODE picks one PDF per stub, per employee or for the whole run.
+    Output PDFs whose inputs hash the same as in MANIFEST_FILE and that still
+    exist are skipped, so re-running after correcting one employee only
+    renders that employee's stubs.
+    """
+    manifest = read_manifest()
+    generated = skipped = failed = stubs_generated = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor, \
+            open(MANIFEST_FILE, "a", encoding="utf-8") as manifest_out:
+        running = {}
+        jobs = iter_jobs(path)
+        while True:
+            for filename_pdf, sha256, count, render, args in jobs:
+                if manifest.get(filename_pdf) == sha256 and os.path.exists(filename_pdf):
+                    skipped += 1
+                    continue
+                os.makedirs(os.path.dirname(filename_pdf), exist_ok=True)
+                running[executor.submit(render, *args)] = (filename_pdf, sha256, count)
+                if len(running) >= MAX_IN_FLIGHT:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename_pdf, sha256, count = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error generating {filename_pdf}: {e}")
+                    failed += 1
+                    continue
+                generated += 1
+                stubs_generated += count
+                manifest_out.write(json.dumps({"filename": filename_pdf, "sha256": sha256}) + "\n")
+                manifest_out.flush()
+                print(f"Generated: {filename_pdf}")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{generated} PDFs with {stubs_generated} pay stubs generated, {skipped} unchanged, {failed} failed"
+        f" in {elapsed:.2f}s with {WORKERS} workers ({stubs_generated / elapsed if elapsed else 0:.0f} stubs/sec)"
+    )
+
+if __name__ == "__main__":
+    # Generate pay stubs
+    if PAYROLL_FILE:
+        generate_from_payroll(PAYROLL_FILE)
+    else:
+        generate_paystubs(pay_dates)
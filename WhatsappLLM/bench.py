@@ -0,0 +1,213 @@
+"""
+Benchmark the WhatsAppAI chat pipeline without a real model.
+
+Generates synthetic WhatsApp exports, replaces the ollama module with a local
+stub that simulates latency and token throughput, and reports parse
+throughput, peak memory, prompt size and query latency percentiles. Each
+export size runs in its own process, so its peak memory is its own.
+
+Example:
+    python bench.py --lines 10000 100000 1000000 --queries 50 --latency 0.05 --tokens-per-sec 200
+"""
+import os
+import sys
+import time
+import types
+import random
+import shutil
+import asyncio
+import argparse
+import multiprocessing
+import tempfile
+import statistics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SENDERS = ["Alice", "Bob", "Chandra", "Dilani", "Evan", "Farah"]
+WORDS = (
+    "ok sure lol yes no maybe tomorrow tonight dinner lunch meeting call later today "
+    "work home car flight hotel booking price money rent bill paid send photo video "
+    "birthday party gift cake plan weekend trip beach mountain train bus ticket doctor "
+    "school exam project deadline report boss team client invoice pizza coffee movie"
+).split()
+
+
+class FakeOllama:
+    """Stand-in for the ollama module with configurable latency and token throughput."""
+
+    def __init__(self, latency, tokens_per_sec, answer_tokens):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.prompt_bytes = []
+
+    def _record(self, messages):
+        self.prompt_bytes.append(sum(len(m["content"].encode("utf-8")) for m in messages))
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self._record(messages)
+        time.sleep(self.latency + self.answer_tokens / self.tokens_per_sec)
+        return {"message": {"content": " ".join(random.choices(WORDS, k=self.answer_tokens))}}
+
+    def embeddings(self, model, prompt, **kwargs):
+        time.sleep(self.latency)
+        return {"embedding": [float(prompt.count(word)) for word in WORDS]}
+
+    def module(self):
+        fake = self
+
+        class AsyncClient:
+            async def chat(self, model, messages, stream=False, **kwargs):
+                fake._record(messages)
+                await asyncio.sleep(fake.latency)
+
+                async def tokens():
+                    for word in random.choices(WORDS, k=fake.answer_tokens):
+                        await asyncio.sleep(1 / fake.tokens_per_sec)
+                        yield {"message": {"content": word + " "}}
+
+                return tokens()
+
+        module = types.ModuleType("ollama")
+        module.chat = self.chat
+        module.embeddings = self.embeddings
+        module.AsyncClient = AsyncClient
+        return module
+
+
+def generate_export(path, lines, seed=0):
+    """Write a synthetic export of about `lines` lines, with some multi-line messages."""
+    rng = random.Random(seed)
+    day = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(lines):
+            if i and rng.random() < 0.05:
+                file.write(" ".join(rng.choices(WORDS, k=rng.randint(2, 12))) + "\n")
+                continue
+            if rng.random() < 0.01:
+                day += 1
+            hour, minute = rng.randint(1, 12), rng.randint(0, 59)
+            month, date, year = day // 28 % 12 + 1, day % 28 + 1, 20 + day // 336
+            text = " ".join(rng.choices(WORDS, k=rng.randint(1, 25)))
+            file.write(f"{month}/{date}/{year}, {hour}:{minute:02d} PM - {rng.choice(SENDERS)}: {text}\n")
+
+
+def peak_rss_mb():
+    """High-water mark of this process's RSS, so only meaningful once per process."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(llm, fake, export_path, lines, args):
+    size_mb = os.path.getsize(export_path) / (1024 * 1024)
+
+    start = time.perf_counter()
+    store = llm.open_store(export_path)
+    parse_time = time.perf_counter() - start
+    count = len(store)
+    store.close()
+
+    start = time.perf_counter()
+    ai = llm.WhatsAppAI(args.model, export_path)
+    index_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    llm.WhatsAppAI(args.model, export_path).messages.close()
+    warm_open_time = time.perf_counter() - start
+
+    rng = random.Random(1)
+    queries = [f"{' '.join(rng.choices(WORDS, k=3))} #{i}" for i in range(args.queries)]
+    fake.prompt_bytes.clear()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        ai.ask_ai(query)
+        latencies.append(time.perf_counter() - start)
+    prompt_bytes = list(fake.prompt_bytes)
+
+    batch_queries = [f"{query} batch" for query in queries]
+    start = time.perf_counter()
+    asyncio.run(ai.ask_many(batch_queries, concurrency=args.concurrency))
+    batch_time = time.perf_counter() - start
+
+    print(f"\n=== {lines:,} lines ({size_mb:.1f} MB, {count:,} messages) ===")
+    print(f"parse:          {parse_time:.2f}s  {lines / parse_time:,.0f} lines/s  {size_mb / parse_time:.1f} MB/s")
+    print(f"index build:    {index_time:.2f}s")
+    print(f"warm open:      {warm_open_time * 1000:.1f} ms")
+    rss = peak_rss_mb()
+    if rss is not None:
+        print(f"peak RSS:       {rss:.1f} MB")
+    print(f"prompt bytes:   mean {statistics.mean(prompt_bytes):,.0f}  max {max(prompt_bytes):,}")
+    print(
+        f"query latency:  p50 {percentile(latencies, 50) * 1000:.1f} ms  "
+        f"p90 {percentile(latencies, 90) * 1000:.1f} ms  p99 {percentile(latencies, 99) * 1000:.1f} ms"
+    )
+    print(f"ask_many:       {len(batch_queries) / batch_time:.1f} queries/s at concurrency {args.concurrency}")
+
+    if args.summary:
+        for label in ("cold", "warm"):
+            fake.prompt_bytes.clear()
+            start = time.perf_counter()
+            ai.ask_ai(f"what did we decide ({label})", mode="summary")
+            print(
+                f"summary {label}:   {time.perf_counter() - start:.2f}s  {len(fake.prompt_bytes)} model calls  "
+                f"final prompt {fake.prompt_bytes[-1]:,} bytes"
+            )
+
+    ai.messages.close()
+
+
+def run_process(export_path, lines, args):
+    """Subprocess entry point: benchmark one export against a fresh llm module."""
+    fake = FakeOllama(args.latency, args.tokens_per_sec, args.answer_tokens)
+    sys.modules["ollama"] = fake.module()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import llm
+
+    run(llm, fake, export_path, lines, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="export sizes to benchmark, in lines (10k to 10M)")
+    parser.add_argument("--queries", type=int, default=50, help="questions per export size")
+    parser.add_argument("--concurrency", type=int, default=4, help="ask_many concurrency")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated seconds per model call")
+    parser.add_argument("--tokens-per-sec", type=float, default=500, help="simulated generation speed")
+    parser.add_argument("--answer-tokens", type=int, default=20, help="tokens per simulated answer")
+    parser.add_argument("--summary", action="store_true", help="also time summary mode, cold and warm")
+    parser.add_argument("--model", default="bench-model")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="whatsapp_bench_")
+    cwd = os.getcwd()
+    os.chdir(work_dir)  # Keep llm.CACHE_DIR and the generated exports out of the repo
+    try:
+        for lines in args.lines:
+            # Generate the export here so its cost stays out of the measured process
+            export_path = os.path.abspath(f"bench_{lines}.txt")
+            generate_export(export_path, lines)
+            process = multiprocessing.Process(target=run_process, args=(export_path, lines, args))
+            process.start()
+            process.join()
+            os.remove(export_path)
+            if process.exitcode:
+                print(f"\n{lines:,} lines: benchmark process exited with code {process.exitcode}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
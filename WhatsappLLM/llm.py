@@ -1,61 +1,758 @@
+import io
 import os
-import ollama
+import re
 import json
+import time
+import math
+import mmap
+import heapq
+import pickle
+import shutil
+import asyncio
+import hashlib
+import sqlite3
+import itertools
+import tempfile
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import ollama
+
+WINDOW_SIZE = 20  # Consecutive messages per retrievable window
+TOP_K = 5  # Windows sent to the model per question
+RERANK_POOL = 4  # With embeddings, rerank TOP_K * RERANK_POOL BM25 candidates
+
+CACHE_DIR = ".whatsapp_cache"  # Parsed message stores, keyed by export file hash
+STORE_VERSION = 1
+
+CHUNK_TOKENS = 3000  # Token budget per chunk in summary mode
+CHARS_PER_TOKEN = 4  # Rough estimate; avoids loading a tokenizer
+SUMMARY_WORKERS = 4  # Concurrent chunk summaries sent to Ollama
+ANSWER_CACHE_BYTES = 64 * 1024 * 1024  # Answers kept before least-recently-used eviction
+SUMMARY_PROMPT = (
+    "Summarize the following part of a WhatsApp chat. Keep names, dates, decisions, "
+    "plans and facts; drop small talk.\n\n"
+)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "did", "do", "for", "from",
+    "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "so", "that", "the",
+    "this", "to", "was", "we", "what", "when", "where", "who", "why", "with", "you",
+}
+
+
+def parse_line(line):
+    """Split a "timestamp - sender: message" export line, or return None."""
+    if '-' not in line or ':' not in line:
+        return None
+    try:
+        timestamp, message = line.split('-', 1)
+        sender, content = message.split(':', 1)
+    except ValueError:
+        return None  # Skip malformed lines
+    return timestamp.strip(), sender.strip(), content.strip()
+
+
+def iter_parsed(source_path, start_byte=0):
+    """Stream parsed messages from an export file, optionally starting at a byte offset."""
+    with open(source_path, "rb") as raw:
+        raw.seek(start_byte)
+        for line in io.TextIOWrapper(raw, encoding="utf-8"):
+            parsed = parse_line(line)
+            if parsed is not None:
+                yield parsed
+
+
+def message_digest(timestamp, sender, content):
+    return hashlib.sha1(f"{timestamp}\x1f{sender}\x1f{content}".encode("utf-8")).hexdigest()
+
+
+def file_sha256(path, prefix_len=None, chunk_size=1 << 20):
+    """
+    Return (sha256, prefix_sha256) of a file, where the second digest covers
+    only its first prefix_len bytes (None if prefix_len is None or too long).
+    """
+    digest = hashlib.sha256()
+    prefix_digest = None
+    read = 0
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            if prefix_len is not None and read <= prefix_len < read + len(chunk):
+                digest.update(chunk[:prefix_len - read])
+                prefix_digest = digest.copy().hexdigest()
+                digest.update(chunk[prefix_len - read:])
+            else:
+                digest.update(chunk)
+            read += len(chunk)
+    if prefix_len is not None and prefix_len == read:
+        prefix_digest = digest.hexdigest()
+    return digest.hexdigest(), prefix_digest
+
+
+def write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+class MessageStore:
+    """
+    Compact, memory-mapped message store, parsed once per export file.
+
+    Files in the store directory:
+      text.bin    utf-8 timestamps and message bodies, back to back
+      bounds.bin  uint64 offsets [ts_0, body_0, ts_1, body_1, ..., end]
+      senders.bin uint32 interned sender id per message
+      meta.json   sender names, message count and source info
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as file:
+            self.meta = json.load(file)
+        self.sender_names = self.meta["senders"]
+        self._maps = []
+        self.text = self._map("text.bin")
+        self.bounds = self._map("bounds.bin").cast("Q")
+        self.senders = self._map("senders.bin").cast("I")
+
+    def _map(self, name):
+        with open(os.path.join(self.store_dir, name), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return memoryview(b"")
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped)
+
+    def close(self):
+        self.text = self.bounds = self.senders = None
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    @staticmethod
+    def _write_messages(store_dir, messages, sender_ids, offset, mode):
+        """
+        Write parsed messages to the store's column files, appending if mode is "ab".
+
+        Returns (count, end_offset, last_message).
+        """
+        count = 0
+        last = None
+        with open(os.path.join(store_dir, "text.bin"), mode) as text_file, \
+                open(os.path.join(store_dir, "bounds.bin"), mode) as bounds_file, \
+                open(os.path.join(store_dir, "senders.bin"), mode) as senders_file:
+            # bounds.bin starts with the first timestamp offset; each message
+            # then adds its body start and the offset where the next one begins
+            bounds = array("Q", [offset] if mode == "wb" else [])
+            senders = array("I")
+            for timestamp, sender, content in messages:
+                encoded_timestamp, encoded_content = timestamp.encode("utf-8"), content.encode("utf-8")
+                offset += len(encoded_timestamp)
+                bounds.append(offset)
+                offset += len(encoded_content)
+                bounds.append(offset)
+                senders.append(sender_ids.setdefault(sender, len(sender_ids)))
+                text_file.write(encoded_timestamp)
+                text_file.write(encoded_content)
+                count += 1
+                last = (timestamp, sender, content)
+                if len(senders) >= 65536:
+                    bounds.tofile(bounds_file)
+                    senders.tofile(senders_file)
+                    del bounds[:], senders[:]
+            bounds.tofile(bounds_file)
+            senders.tofile(senders_file)
+        return count, offset, last
+
+    @staticmethod
+    def _write_meta(store_dir, count, sender_ids, source_path, source_sha256, last, previous_anchor=None):
+        anchor = previous_anchor
+        if last is not None:
+            anchor = {"index": count - 1, "timestamp": last[0], "digest": message_digest(*last)}
+        write_json(os.path.join(store_dir, "meta.json"), {
+            "version": STORE_VERSION,
+            "count": count,
+            "senders": list(sender_ids),
+            "source_sha256": source_sha256,
+            "source_bytes": os.path.getsize(source_path),
+            "anchor": anchor,
+        })
+
+    @classmethod
+    def build(cls, source_path, store_dir, source_sha256=None):
+        """
+        Stream-parse an export file into a new store and open it.
+        """
+        tmp_dir = f"{store_dir}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        sender_ids = {}
+        count, _, last = cls._write_messages(tmp_dir, iter_parsed(source_path), sender_ids, 0, "wb")
+        cls._write_meta(tmp_dir, count, sender_ids, source_path, source_sha256, last)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)  # Stale store from an older STORE_VERSION
+        os.replace(tmp_dir, store_dir)
+        return cls(store_dir)
+
+    @classmethod
+    def extend(cls, store_dir, source_path, source_sha256, start_byte=0, skip_messages=0):
+        """
+        Append the messages of source_path after the already-stored prefix, in place.
+
+        The store must not be open while it is extended.
+        """
+        meta = read_meta(store_dir)
+        sender_ids = {name: i for i, name in enumerate(meta["senders"])}
+        offset = os.path.getsize(os.path.join(store_dir, "text.bin"))
+        tail = itertools.islice(iter_parsed(source_path, start_byte), skip_messages, None)
+        added, _, last = cls._write_messages(store_dir, tail, sender_ids, offset, "ab")
+        cls._write_meta(store_dir, meta["count"] + added, sender_ids, source_path, source_sha256,
+                        last, meta.get("anchor"))
+        return added
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def timestamp(self, i):
+        return str(self.text[self.bounds[2 * i]:self.bounds[2 * i + 1]], "utf-8")
+
+    def sender(self, i):
+        return self.sender_names[self.senders[i]]
+
+    def message(self, i):
+        return str(self.text[self.bounds[2 * i + 1]:self.bounds[2 * i + 2]], "utf-8")
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {"timestamp": self.timestamp(i), "sender": self.sender(i), "message": self.message(i)}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return meta if meta.get("version") == STORE_VERSION else None
+
+
+def locate_tail(source_path, meta, prefix_matches):
+    """
+    Find where the new messages start in a re-exported chat.
+
+    Returns (start_byte, skip_messages) for the tail that still needs parsing,
+    or None if the file does not extend the stored messages. A byte-identical
+    prefix lets parsing start right after it; otherwise the file is scanned for
+    the last stored message, matched by position, timestamp and content hash.
+    """
+    source_bytes = meta["source_bytes"]
+    if prefix_matches:
+        if source_bytes == 0:
+            return 0, 0
+        with open(source_path, "rb") as file:
+            file.seek(source_bytes - 1)
+            if file.read(1) == b"\n":
+                return source_bytes, 0
+
+    anchor = meta.get("anchor")
+    if anchor is None:
+        return None
+    for i, parsed in enumerate(iter_parsed(source_path)):
+        if i == anchor["index"]:
+            if parsed[0] == anchor["timestamp"] and message_digest(*parsed) == anchor["digest"]:
+                return 0, i + 1
+            return None
+    return None
+
+
+def open_store(file_path, cache_dir=CACHE_DIR, incremental=True):
+    """
+    Open the message store for an export file, parsing it only on first use.
+
+    Stores are keyed by the file's SHA-256. Known (size, mtime) pairs are
+    remembered in sources.json so unchanged files are not even re-hashed.
+    With incremental=True, a re-export of a chat already stored for the same
+    path only has its new tail parsed and appended to the previous store,
+    which is then re-keyed under the new hash.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sources_path = os.path.join(cache_dir, "sources.json")
+    try:
+        with open(sources_path, encoding="utf-8") as file:
+            sources = json.load(file)
+    except (FileNotFoundError, ValueError):
+        sources = {}
+
+    key = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    known = sources.get(key)
+    previous_dir = previous_meta = prefix_sha256 = None
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        sha256 = known["sha256"]
+    else:
+        if known and incremental:
+            previous_dir = os.path.join(cache_dir, known["sha256"])
+            previous_meta = read_meta(previous_dir)
+        prefix_len = previous_meta["source_bytes"] if previous_meta else None
+        sha256, prefix_sha256 = file_sha256(file_path, prefix_len)
+        sources[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        write_json(sources_path, sources)
+
+    store_dir = os.path.join(cache_dir, sha256)
+    if read_meta(store_dir):
+        return MessageStore(store_dir)
+
+    if previous_meta and previous_dir != store_dir:
+        prefix_matches = prefix_sha256 == previous_meta["source_sha256"]
+        tail = locate_tail(file_path, previous_meta, prefix_matches)
+        if tail is not None:
+            print(f"Appending new messages from {file_path} to {previous_dir}...")
+            MessageStore.extend(previous_dir, file_path, sha256, *tail)
+            if os.path.exists(store_dir):
+                shutil.rmtree(store_dir)
+            os.replace(previous_dir, store_dir)
+            return MessageStore(store_dir)
+
+    print(f"Parsing {file_path} into {store_dir}...")
+    return MessageStore.build(file_path, store_dir, sha256)
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivially different questions match."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Persistent SQLite cache of answers, keyed by model, context digest and
+    normalized question, evicted least-recently-used once over max_bytes.
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "answers.sqlite"), max_bytes=ANSWER_CACHE_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(model_name, context, query):
+        context_digest = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{model_name}\0{context_digest}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            return row[0]
+
+    def put(self, key, answer):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, len(answer.encode("utf-8")), time.time()),
+            )
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+            if total > self.max_bytes:
+                evict = []
+                for old_key, size in self.db.execute("SELECT key, size FROM answers ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    total -= size
+                self.db.executemany("DELETE FROM answers WHERE key = ?", evict)
+            self.db.commit()
+
+
+def tokenize(text):
+    """Lowercase word tokens with common stopwords removed."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class ChatIndex:
+    """
+    BM25 inverted index over fixed-size windows of consecutive chat messages.
+
+    Postings are stored per term as a flat array of (window_id, term_freq) pairs,
+    which keeps the index compact for multi-year chats.
+    """
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = array("I")
+        self.total_length = 0
+        self.embeddings = {}  # window_id -> embedding vector, filled lazily
+        self.messages_indexed = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add_window(self, text):
+        """Index one window of text and return its window id."""
+        window_id = len(self.lengths)
+        counts = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, freq in counts.items():
+            self.postings.setdefault(token, array("I")).extend((window_id, freq))
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return window_id
+
+    def pop_window(self, text):
+        """
+        Remove the most recently added window, given the text it was indexed with.
+
+        Postings are appended in window order, so the last window's entry is
+        always at the end of each of its terms' posting arrays.
+        """
+        window_id = len(self.lengths) - 1
+        for token in set(tokenize(text)):
+            postings = self.postings[token]
+            del postings[-2:]
+            if not postings:
+                del self.postings[token]
+        self.total_length -= self.lengths.pop()
+        self.embeddings.pop(window_id, None)
+
+    def search(self, query, k):
+        """Return up to k (score, window_id) pairs, best first."""
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1
+        scores = {}
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            df = len(postings) // 2
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i in range(0, len(postings), 2):
+                window_id, freq = postings[i], postings[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[window_id] / avg_length)
+                scores[window_id] = scores.get(window_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return heapq.nlargest(k, ((score, window_id) for window_id, score in scores.items()))
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
 
 class WhatsAppAI:
-    def __init__(self, model_name, messages_file):
+    def __init__(self, model_name, messages_file, top_k=TOP_K, embed_model=None):
         """
         Initialize the WhatsAppAI with a local Ollama model and message file.
+
+        The chat is parsed and indexed once; each question then only sends the
+        top_k most relevant message windows to the model. If embed_model is set,
+        BM25 candidates are reranked with Ollama embeddings from that model.
+        Both the parsed messages and the index are cached on disk, keyed by the
+        export file's hash, so later sessions skip parsing entirely.
         """
         self.model_name = model_name
+        self.top_k = top_k
+        self.embed_model = embed_model
+        self.index_lock = threading.Lock()  # ask_many retrieves from several threads at once
+        self.answer_cache = AnswerCache()
         self.messages = self.load_messages(messages_file)
+        self.index = self.load_index()
 
     def load_messages(self, file_path):
         """
-        Load and process WhatsApp chat messages from a .txt file.
+        Load WhatsApp chat messages from a .txt file into a compact message store.
         """
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.readlines()
+        return open_store(file_path)
 
     def format_messages(self):
         """
         Format messages into a structured conversation.
         """
-        chat_history = []
-        for line in self.messages:
-            if '-' in line and ':' in line:
-                try:
-                    timestamp, message = line.split('-', 1)
-                    sender, content = message.split(':', 1)
-                    chat_history.append({"timestamp": timestamp.strip(), "sender": sender.strip(), "message": content.strip()})
-                except ValueError:
-                    continue  # Skip malformed lines
-        return chat_history
-
-    def ask_ai(self, query):
-        """
-        Ask a question about the entire chat history using the local Ollama model.
-        """
-        formatted_chat = self.format_messages()
-        chat_context = json.dumps(formatted_chat)  # Use the entire chat history
-        prompt = f"""
-        Given the following complete WhatsApp chat history:
+        return list(self.messages)
+
+    def window_text(self, window_id, limit=None):
+        """
+        Render one window of messages as compact "timestamp - sender: message" lines,
+        optionally only up to message number limit.
+        """
+        start = window_id * WINDOW_SIZE
+        end = min(start + WINDOW_SIZE, len(self.messages) if limit is None else limit)
+        store = self.messages
+        return "\n".join(
+            f"{store.timestamp(i)} - {store.sender(i)}: {store.message(i)}" for i in range(start, end)
+        )
+
+    def build_index(self):
+        """
+        Build the retrieval index over consecutive windows of the chat history.
+        """
+        return self.update_index(ChatIndex())
+
+    def update_index(self, index):
+        """
+        Index messages appended since the index was last saved, in place.
+
+        A trailing partial window is dropped and re-added with its new messages;
+        every other window is left untouched.
+        """
+        indexed = index.messages_indexed
+        if indexed % WINDOW_SIZE:
+            index.pop_window(self.window_text(indexed // WINDOW_SIZE, limit=indexed))
+        for window_id in range(len(index), math.ceil(len(self.messages) / WINDOW_SIZE)):
+            index.add_window(self.window_text(window_id))
+        index.messages_indexed = len(self.messages)
+        return index
+
+    def index_path(self):
+        return os.path.join(self.messages.store_dir, "index.pickle")
+
+    def load_index(self):
+        """
+        Load the retrieval index saved next to the message store, building it if needed.
+        """
+        try:
+            with open(self.index_path(), "rb") as file:
+                window_size, index = pickle.load(file)
+            if window_size == WINDOW_SIZE:
+                if index.messages_indexed < len(self.messages):
+                    self.update_index(index)
+                    self.save_index(index)
+                return index
+        except (FileNotFoundError, EOFError, AttributeError, pickle.UnpicklingError):
+            pass
+        index = self.build_index()
+        self.save_index(index)
+        return index
+
+    def save_index(self, index=None):
+        with tempfile.NamedTemporaryFile(dir=self.messages.store_dir, suffix=".tmp", delete=False) as file:
+            pickle.dump((WINDOW_SIZE, self.index if index is None else index), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file.name, self.index_path())
+
+    def embed(self, text):
+        return ollama.embeddings(model=self.embed_model, prompt=text)["embedding"]
+
+    def retrieve(self, query):
+        """
+        Return the ids of the most relevant windows for a query, in chat order.
+        """
+        pool = self.top_k * RERANK_POOL if self.embed_model else self.top_k
+        candidates = [window_id for _, window_id in self.index.search(query, pool)]
+        if self.embed_model and candidates:
+            query_vector = self.embed(query)
+            # Embed outside the lock so concurrent queries overlap their model calls
+            missing = {
+                window_id: self.embed(self.window_text(window_id))
+                for window_id in candidates if window_id not in self.index.embeddings
+            }
+            if missing:
+                with self.index_lock:
+                    self.index.embeddings.update(missing)
+                    self.save_index()
+            candidates.sort(key=lambda w: cosine(query_vector, self.index.embeddings[w]), reverse=True)
+        if not candidates:
+            # Nothing matched lexically; fall back to the most recent messages
+            candidates = list(range(max(0, len(self.index) - self.top_k), len(self.index)))
+        return sorted(candidates[:self.top_k])
+
+    def build_context(self, query):
+        return "\n...\n".join(self.window_text(window_id) for window_id in self.retrieve(query))
+
+    def chat(self, prompt):
+        response = ollama.chat(model=self.model_name, messages=[{"role": "user", "content": prompt}])
+        return response["message"]["content"].strip()
+
+    def iter_chunks(self, token_budget=CHUNK_TOKENS):
+        """
+        Yield the formatted chat history in consecutive chunks of roughly token_budget tokens.
+
+        Chunks always start from the first message, so appending messages only
+        changes the last chunk and every earlier chunk keeps its content hash.
+        """
+        char_budget = token_budget * CHARS_PER_TOKEN
+        chunk, size = [], 0
+        for message in self.messages:
+            line = f"{message['timestamp']} - {message['sender']}: {message['message']}"
+            if chunk and size + len(line) > char_budget:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line) + 1
+        if chunk:
+            yield "\n".join(chunk)
+
+    def summarize(self, text):
+        """
+        Summarize one chunk of text, cached on disk by model and content hash.
+        """
+        key = hashlib.sha256(f"{self.model_name}\0{SUMMARY_PROMPT}{text}".encode("utf-8")).hexdigest()
+        path = os.path.join(CACHE_DIR, "summaries", f"{key}.txt")
+        try:
+            with open(path, encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+        summary = self.chat(SUMMARY_PROMPT + text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Identical chunks may be summarized concurrently, so each writer gets its own temp file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path),
+                                         suffix=".tmp", delete=False) as file:
+            file.write(summary)
+        os.replace(file.name, path)
+        return summary
+
+    def summarize_all(self, texts, executor):
+        """
+        Summarize texts concurrently, keeping at most 2 * SUMMARY_WORKERS chunks in flight.
+        """
+        summaries, pending = [], []
+        for text in texts:
+            pending.append(executor.submit(self.summarize, text))
+            if len(pending) >= 2 * SUMMARY_WORKERS:
+                summaries.append(pending.pop(0).result())
+        summaries.extend(future.result() for future in pending)
+        return summaries
+
+    def build_summary_context(self, token_budget=CHUNK_TOKENS):
+        """
+        Map-reduce the whole chat into summaries that fit within token_budget.
+
+        Chunks are summarized concurrently, then groups of summaries are
+        summarized again until the result fits. Every level is cached, so a
+        repeated question over an unchanged chat makes no summary calls at all.
+        """
+        with ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as executor:
+            summaries = self.summarize_all(self.iter_chunks(token_budget), executor)
+            char_budget = token_budget * CHARS_PER_TOKEN
+            while len(summaries) > 1 and sum(len(summary) + 2 for summary in summaries) > char_budget:
+                groups, group, size = [], [], 0
+                for summary in summaries:
+                    if group and size + len(summary) > char_budget:
+                        groups.append("\n\n".join(group))
+                        group, size = [], 0
+                    group.append(summary)
+                    size += len(summary) + 2
+                groups.append("\n\n".join(group))
+                if len(groups) == len(summaries):
+                    break  # Every summary fills the budget alone; reducing further cannot help
+                summaries = self.summarize_all(groups, executor)
+        return "\n\n".join(summaries)
+
+    def build_prompt(self, query, mode="retrieval", chat_context=None):
+        """
+        Return (chat_context, prompt) for a question; see ask_ai for the modes.
+        """
+        if mode == "summary":
+            chat_context = self.build_summary_context() if chat_context is None else chat_context
+            prompt = f"""
+        Given the following summary of a complete WhatsApp chat history:
         {chat_context}
         Answer the question concisely:
         {query}
         """
-        response = ollama.chat(model=self.model_name, messages=[{"role": "user", "content": prompt}])
-        return response["message"]["content"].strip()
+        else:
+            chat_context = self.build_context(query) if chat_context is None else chat_context
+            prompt = f"""
+        Given the following excerpts from a WhatsApp chat history:
+        {chat_context}
+        Answer the question concisely:
+        {query}
+        """
+        return chat_context, prompt
+
+    def ask_ai(self, query, mode="retrieval"):
+        """
+        Ask a question about the chat history using the local Ollama model.
+
+        In "retrieval" mode only the retrieved message windows are included, so
+        the prompt size stays flat as the chat grows. "summary" mode answers from
+        a map-reduce summary of the whole chat, for questions about all of it.
+        Answers are cached, so repeating a question over the same context is free.
+        """
+        chat_context, prompt = self.build_prompt(query, mode)
+        key = AnswerCache.key(self.model_name, chat_context, query)
+        answer = self.answer_cache.get(key)
+        if answer is None:
+            answer = self.chat(prompt)
+            self.answer_cache.put(key, answer)
+        return answer
+
+    async def ask_many(self, queries, mode="retrieval", concurrency=4, on_token=None):
+        """
+        Answer many questions concurrently and return the answers in query order.
+
+        At most `concurrency` requests are sent to Ollama at once. Responses are
+        streamed, and on_token(query_index, token) is called for every token
+        received. Cached answers are returned without calling the model.
+        """
+        client = ollama.AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        shared_context = None
+        if mode == "summary":
+            # The summary context does not depend on the question; build it once
+            shared_context = await asyncio.to_thread(self.build_summary_context)
+
+        async def answer(index, query):
+            async with semaphore:
+                chat_context, prompt = await asyncio.to_thread(self.build_prompt, query, mode, shared_context)
+                key = AnswerCache.key(self.model_name, chat_context, query)
+                cached = self.answer_cache.get(key)
+                if cached is not None:
+                    return cached
+                parts = []
+                stream = await client.chat(
+                    model=self.model_name, messages=[{"role": "user", "content": prompt}], stream=True
+                )
+                async for chunk in stream:
+                    token = chunk["message"]["content"]
+                    parts.append(token)
+                    if on_token:
+                        on_token(index, token)
+                result = "".join(parts).strip()
+                self.answer_cache.put(key, result)
+                return result
+
+        return await asyncio.gather(*(answer(i, query) for i, query in enumerate(queries)))
 
 if __name__ == "__main__":
     model_name = "tinyllama"  # Fastest model for a MacBook Pro 2018
     messages_file = "messages.txt"  # Update with actual chat file path
+    embed_model = None  # e.g. "nomic-embed-text" to rerank results with embeddings
+    mode = "retrieval"  # "summary" to answer from a summary of the whole chat
+    questions_file = None  # e.g. "questions.txt" to answer one question per line in a batch
+
+    ai = WhatsAppAI(model_name, messages_file, embed_model=embed_model)
 
-    ai = WhatsAppAI(model_name, messages_file)
+    if questions_file:
+        with open(questions_file, "r", encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+        answers = asyncio.run(ai.ask_many(questions, mode=mode))
+        for question, answer in zip(questions, answers):
+            print(f"Q: {question}\nA: {answer}\n")
+        raise SystemExit
 
     while True:
         query = input("Ask a question about your chat (or type 'exit' to quit): ")
         if query.lower() == 'exit':
             break
-        response = ai.ask_ai(query)
+        response = ai.ask_ai(query, mode=mode)
         print("AI Response:", response)
@@ -1,46 +1,212 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import fitz
 
-def split_and_landscape_pdf(input_pdf, output_pdf):
-    try:
-        doc = fitz.open(input_pdf)
+# Batch settings
+WORKERS = os.cpu_count() or 1  # Worker processes splitting page ranges in parallel
+PAGES_PER_PART = 50  # Source pages per worker job; bounds each worker's memory
+MAX_IN_FLIGHT = WORKERS * 2  # Page ranges queued or running at once
+
+# Raster mode settings
+RASTER_DPI = 72  # Render resolution of each source page; raise for sharper output
+RASTER_COLORSPACE = "rgb"  # "rgb" or "gray"
+RASTER_JPEG_QUALITY = None  # e.g. 80 to store pages as JPEG instead of lossless Flate
+
+def page_halves(rect):
+    return [
+        fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height / 2),
+        fitz.Rect(rect.x0, rect.y0 + rect.height / 2, rect.x1, rect.y1),
+    ]
+
+def place_halves_vector(new_doc, doc, page_num, rotate=0):
+    """
+    Place the top and bottom halves of a source page on two new landscape pages.
+
+    Each half is shown with show_pdf_page, clipped from the original page, so
+    text and vector graphics are kept as-is and nothing is rasterized. Both
+    halves reference the same form XObject of the source page.
+    """
+    page = doc[page_num]
+    rect = page.rect
+    width = rect.width
+    height = rect.height
+    for clip in page_halves(rect):
+        new_page = new_doc.new_page(width=height, height=width)
+        new_page.show_pdf_page(new_page.rect, doc, page_num, clip=clip, rotate=rotate)
+
+def place_halves_raster(new_doc, doc, page_num):
+    """
+    Rasterize the top and bottom halves of a source page onto two new landscape pages.
+
+    The page is interpreted once into a display list and each half is rendered
+    from it at RASTER_DPI into RASTER_COLORSPACE, so every source pixel is
+    embedded exactly once instead of the whole page image once per half.
+    Images are JPEG-encoded when RASTER_JPEG_QUALITY is set, else Flate.
+    """
+    page = doc[page_num]
+    rect = page.rect
+    width = rect.width
+    height = rect.height
+    colorspace = fitz.csGRAY if RASTER_COLORSPACE == "gray" else fitz.csRGB
+    matrix = fitz.Matrix(RASTER_DPI / 72, RASTER_DPI / 72)
+    display_list = page.get_displaylist()
+    for clip in page_halves(rect):
+        pix = display_list.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False, clip=clip)
+        new_page = new_doc.new_page(width=height, height=width)
+        if RASTER_JPEG_QUALITY:
+            new_page.insert_image(new_page.rect, stream=pix.tobytes("jpeg", jpg_quality=RASTER_JPEG_QUALITY))
+        else:
+            new_page.insert_image(new_page.rect, pixmap=pix)
+
+def split_pages(input_pdf, part_pdf, first, last, mode="vector"):
+    """
+    Worker entry point: split source pages first..last-1 into part_pdf.
+
+    Only this range's output pages are held in memory, and the part is written
+    compressed, so a worker's footprint depends on PAGES_PER_PART, not on the
+    length of the document. Returns the seconds spent splitting.
+    """
+    start = time.perf_counter()
+    with fitz.open(input_pdf) as doc, fitz.open() as new_doc:
+        for page_num in range(first, last):
+            if mode == "vector":
+                place_halves_vector(new_doc, doc, page_num)
+            else:
+                place_halves_raster(new_doc, doc, page_num)
+        new_doc.save(part_pdf, garbage=3, deflate=True)
+    return time.perf_counter() - start
+
+def merge_parts(parts, output_pdf):
+    """
+    Concatenate the part files in order into output_pdf and delete them.
+
+    Parts are opened one at a time; the final save drops duplicate and unused
+    objects and deflates every stream.
+    """
+    with fitz.open() as merged:
+        for part in parts:
+            with fitz.open(part) as doc:
+                merged.insert_pdf(doc)
+        merged.save(f"{output_pdf}.tmp", garbage=4, deflate=True)
+    os.replace(f"{output_pdf}.tmp", output_pdf)
+    for part in parts:
+        os.remove(part)
+
+def plan_jobs(input_pdf, output_pdf, pages_per_part):
+    """
+    Validate input_pdf and return its (input, part, first, last) page ranges.
+    """
+    with fitz.open(input_pdf) as doc:
         if not doc.is_pdf:
             raise ValueError("Input file is not a PDF.")
+        page_count = doc.page_count
+        rect = doc[0].rect
+    if not (8.4 < rect.width < 8.6 and 10.9 < rect.height < 11.1):
+        print(f"Warning: {input_pdf} is not standard letter size. Proceeding but results may vary.")
+    return [
+        (input_pdf, f"{output_pdf}.part{index}", first, min(first + pages_per_part, page_count))
+        for index, first in enumerate(range(0, page_count, pages_per_part))
+    ]
 
-        page = doc[0]
-        rect = page.rect
-        if not (8.4 < rect.width < 8.6 and 10.9 < rect.height < 11.1):
-            print("Warning: Input PDF is not standard letter size. Proceeding but results may vary.")
-
-        new_doc = fitz.open()
+def split_many(files, mode="vector", workers=WORKERS, pages_per_part=PAGES_PER_PART):
+    """
+    Split and landscape every (input_pdf, output_pdf) pair in files.
 
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            width = page.rect.width
-            height = page.rect.height
+    All files' page ranges share one pool of worker processes with at most
+    MAX_IN_FLIGHT ranges submitted; each output is merged as soon as its last
+    range finishes, so finished files don't wait for the rest of the batch.
+    """
+    jobs = []
+    remaining = {}  # output_pdf -> ranges not finished yet
+    for input_pdf, output_pdf in files:
+        try:
+            ranges = plan_jobs(input_pdf, output_pdf, pages_per_part)
+        except Exception as e:
+            print(f"An error occurred with {input_pdf}: {e}")
+            continue
+        remaining[output_pdf] = len(ranges)
+        jobs.extend((output_pdf, job) for job in ranges)
 
-            # Create two NEW landscape pages CORRECTLY
-            new_page1 = new_doc.insert_page(new_doc.page_count, width=height, height=width)
-            new_page2 = new_doc.insert_page(new_doc.page_count, width=height, height=width)
+    parts = {output_pdf: [] for output_pdf in remaining}
+    pages = dict.fromkeys(remaining, 0)
+    busy = dict.fromkeys(remaining, 0.0)
+    failed = set()
+    start = time.perf_counter()
 
-            # Get the pixmap of the original page
-            pix = page.get_pixmap()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        queue = iter(jobs)
+        while True:
+            for output_pdf, job in queue:
+                parts[output_pdf].append(job[1])
+                running[executor.submit(split_pages, *job, mode)] = (output_pdf, job)
+                if len(running) >= MAX_IN_FLIGHT:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                output_pdf, (input_pdf, part_pdf, first, last) = running.pop(future)
+                try:
+                    busy[output_pdf] += future.result()
+                    pages[output_pdf] += last - first
+                except Exception as e:
+                    print(f"An error occurred with {input_pdf} pages {first + 1}-{last}: {e}")
+                    failed.add(output_pdf)
+                remaining[output_pdf] -= 1
+                if remaining[output_pdf]:
+                    continue
+                if output_pdf in failed:
+                    for part in parts[output_pdf]:
+                        if os.path.exists(part):
+                            os.remove(part)
+                    continue
+                merge_parts(parts[output_pdf], output_pdf)
+                per_page = busy[output_pdf] / pages[output_pdf] * 1000 if pages[output_pdf] else 0
+                print(f"PDF split and converted to landscape: {output_pdf}")
+                print(
+                    f"Mode: {mode} | {pages[output_pdf]} pages | {per_page:.1f} ms/page"
+                    f" | output {os.path.getsize(output_pdf) / 1024:.1f} KB"
+                )
 
-            # Define transformation matrices for each half
-            mat1 = fitz.Matrix(width / height, 0, 0, (width/2) / height)  # Scale to half width
-            mat2 = fitz.Matrix(width / height, 0, 0, (width/2) / height)  # Scale to half width
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(parts) - len(failed)} of {len(files)} PDFs done in {elapsed:.1f}s"
+        f" ({sum(pages.values()) / elapsed if elapsed else 0:.1f} pages/sec) with {workers} workers"
+    )
 
-            # Apply rotation and scaling using the matrix
-            new_page1.insert_image(new_page1.rect, image=pix, matrix=mat1, rotate=90)
-            new_page2.insert_image(new_page2.rect, image=pix, matrix=mat2, rotate=90)
+def split_and_landscape_pdf(input_pdf, output_pdf, mode="vector", workers=WORKERS, pages_per_part=PAGES_PER_PART):
+    """
+    Split every page into two landscape pages.
 
-        new_doc.save(output_pdf)
-        print(f"PDF split and converted to landscape: {output_pdf}")
+    mode "vector" clips the original page content onto the new pages;
+    mode "raster" renders each page to an image first (see the RASTER_*
+    settings). Long documents are split in page ranges of pages_per_part across worker
+    processes and merged at the end. Prints per-page time and output size so
+    the two modes can be compared.
+    """
+    split_many([(input_pdf, output_pdf)], mode, workers, pages_per_part)
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def split_folder(input_folder, output_folder, mode="vector", workers=WORKERS, pages_per_part=PAGES_PER_PART):
+    """
+    Split every PDF in input_folder into output_folder, keeping the file names.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    files = [
+        (os.path.join(input_folder, filename), os.path.join(output_folder, filename))
+        for filename in sorted(os.listdir(input_folder))
+        if filename.lower().endswith(".pdf")
+    ]
+    split_many(files, mode, workers, pages_per_part)
 
-# Example usage:
-input_pdf_path = "input.pdf"
-output_pdf_path = "output.pdf"
+if __name__ == "__main__":
+    # Example usage: a single PDF, or a folder of PDFs written to output_path as a folder
+    input_path = "input.pdf"
+    output_path = "output.pdf"
+    mode = "vector"  # "raster" renders pages to images instead (slower, larger, loses text)
 
-split_and_landscape_pdf(input_pdf_path, output_pdf_path)
\ No newline at end of file
+    if os.path.isdir(input_path):
+        split_folder(input_path, output_path, mode=mode)
+    else:
+        split_and_landscape_pdf(input_path, output_path, mode=mode)